@@ -1,26 +1,57 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+import os
 
-from app.config import Config
-from app.load_models import G2P, MATCHA_MODEL, VOCODER, DENOISER
-from app.urls import interface
+# the flask app, the db and the models are created on the first access
+# to `app.app`, `app.db` or `app.migrate` (`from app import app`),
+# so that the modules which don't need them (e.g. app.utils) can be imported on their own
+_LAZY_NAMES = ('app', 'db', 'migrate')
 
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+def _create_app():
+    from flask import Flask
+    from flask_sqlalchemy import SQLAlchemy
+    from flask_migrate import Migrate
 
-app.register_blueprint(interface)
+    from app.config import Config
 
-# for sqlalchemy to work with flask
-app.app_context().push()
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    # IPA in JSON responses as it is, not as \u escapes
+    app.json.ensure_ascii = False
+    db = SQLAlchemy(app)
+    migrate = Migrate(app, db)
+    # the modules imported below use `from app import db`
+    globals().update(app=app, db=db, migrate=migrate)
 
-from app import models
+    # loads the G2P and matcha models
+    from app import load_models  # noqa: F401
+    from app.audio_warmer import AUDIO_WARMER
+    from app.commands import ingest_corpus_command, serve_tts_command
+    from app.urls import api, interface
+
+    app.register_blueprint(interface)
+    app.register_blueprint(api)
+    app.cli.add_command(ingest_corpus_command)
+    app.cli.add_command(serve_tts_command)
+
+    # started by the first request, so that cli commands don't run it
+    if AUDIO_WARMER.enabled:
+        app.before_request(AUDIO_WARMER.start)
+
+    # for sqlalchemy to work with flask
+    app.app_context().push()
+
+    from app import models  # noqa: F401
+    return app
+
+
+def __getattr__(name):
+    if name in _LAZY_NAMES:
+        _create_app()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
     host = os.environ.get('FLASK_RUN_HOST', '127.0.0.1')
     port = int(os.environ.get('FLASK_RUN_PORT', 5000))
-    app.run(debug=False, host=host, port=port)
+    _create_app().run(debug=False, host=host, port=port)
@@ -0,0 +1,151 @@
+from flask import jsonify, request, url_for
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.audio_warmer import AUDIO_WARMER
+from app.ipa_phonemizer import (
+    enrich_model_phonemes_with_db, get_grapheme2phonemes_from_model, is_word
+)
+from app.matcha_utils import (
+    MAX_PHONEME_LENGTH, SCHEDULER, phonemized_to_sequence, synthesize_phonemes
+)
+
+# maximum number of items in one request
+MAX_API_BATCH_SIZE = 1000
+
+
+def g2p_api_view():
+    '''
+    Takes {"words": [...]}.
+    Returns the candidates of every word (the picked one first)
+    and the transcription from the db if there is one:
+    {"words": {word: {"candidates": [...], "picked": ..., "db": ...}}};
+    "picked" is null and "candidates" is empty if the model can't pronounce the word.
+    '''
+    from app.db_utils import fetch_grapheme2phoneme, fetch_variant_counts
+
+    words, error = _get_list_from_json('words')
+    if error:
+        return error
+    words = list(dict.fromkeys(word.strip().lower() for word in words))
+    not_words = [word for word in words if not is_word(word)]
+    if not_words:
+        return api_error(f'Not words: {not_words[:10]}')
+
+    word2db_phoneme = fetch_grapheme2phoneme(words)
+    word2model_phonemes = get_grapheme2phonemes_from_model(words)
+    word2phonemes, word2picked_phoneme = enrich_model_phonemes_with_db(
+        word2model_phonemes, word2db_phoneme, fetch_variant_counts(words))
+
+    return jsonify({
+        'words': {
+            word: {
+                'candidates': _picked_first(phonemes, word2picked_phoneme.get(word)),
+                'picked': word2picked_phoneme.get(word),
+                'db': word2db_phoneme.get(word),
+            }
+            for word, phonemes in word2phonemes.items()
+        }
+    })
+
+
+def synthesize_api_view():
+    '''
+    Takes {"phonemes": [...]}: phonemized strings.
+    Synthesizes each of them once (the audios are cached)
+    and returns {"audio": {phoneme: {"id": ..., "url": ...}}}.
+    '''
+    phonemes, error = _get_list_from_json('phonemes')
+    if error:
+        return error
+    phonemes = [phoneme.strip() for phoneme in phonemes if phoneme.strip()]
+    too_long = [phoneme for phoneme in phonemes if len(phoneme) > MAX_PHONEME_LENGTH]
+    if too_long:
+        return api_error(
+            f'At most {MAX_PHONEME_LENGTH} characters per phoneme string: {too_long[:10]}')
+    # reject the whole batch before synthesizing anything
+    try:
+        for phoneme in phonemes:
+            phonemized_to_sequence(phoneme, unknown_policy='error')
+    except ValueError as e:
+        return api_error(str(e))
+    phoneme2audio = synthesize_phonemes(phonemes)
+
+    return jsonify({
+        'audio': {
+            phoneme: {
+                'id': name,
+                'url': url_for('interface.audio_view', name=name),
+            }
+            for phoneme, name in phoneme2audio.items()
+        }
+    })
+
+
+def synthesis_metrics_api_view():
+    '''
+    Queue depth and batch sizes of the synthesis scheduler.
+    '''
+    return jsonify(SCHEDULER.metrics())
+
+
+def lexicon_api_view():
+    '''
+    GET ?words=a,b,c returns {"lexicon": {word: phoneme}} for the words in the db.
+    POST {"lexicon": {word: phoneme}} adds or changes the transcriptions
+    (every change is logged) and returns the number of the saved words.
+    '''
+    from app import db
+    from app.db_utils import add_graphemes_and_log, fetch_grapheme2phoneme
+
+    if request.method == 'GET':
+        words = [
+            word.strip().lower()
+            for word in request.args.get('words', '').split(',') if word.strip()
+        ]
+        if len(words) > MAX_API_BATCH_SIZE:
+            return api_error(f'At most {MAX_API_BATCH_SIZE} words per request')
+        return jsonify({'lexicon': fetch_grapheme2phoneme(words)})
+
+    payload = request.get_json(silent=True)
+    lexicon = payload.get('lexicon') if isinstance(payload, dict) else None
+    if not isinstance(lexicon, dict):
+        return api_error('Expected a JSON object with a "lexicon" object')
+    if len(lexicon) > MAX_API_BATCH_SIZE:
+        return api_error(f'At most {MAX_API_BATCH_SIZE} words per request')
+    if not all(word.strip() for word in lexicon):
+        return api_error('Every word must be a non-empty string')
+    if not all(isinstance(phoneme, str) and phoneme.strip() for phoneme in lexicon.values()):
+        return api_error('Every transcription must be a non-empty string')
+
+    word2phoneme = {
+        word.strip().lower(): phoneme.strip() for word, phoneme in lexicon.items()}
+    try:
+        changes = add_graphemes_and_log(word2phoneme)
+        db.session.commit()
+        AUDIO_WARMER.rewarm(changes)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print("Error!", e)
+        return api_error('Could not save the lexicon', 500)
+    return jsonify({'saved': len(word2phoneme)})
+
+
+def api_error(message, status=400):
+    return jsonify({'error': message}), status
+
+
+def _get_list_from_json(key):
+    # returns the list of strings under the key, or an error response
+    payload = request.get_json(silent=True)
+    items = payload.get(key) if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+        return None, api_error(f'Expected a JSON object with a "{key}" list of strings')
+    if len(items) > MAX_API_BATCH_SIZE:
+        return None, api_error(f'At most {MAX_API_BATCH_SIZE} {key} per request')
+    return items, None
+
+
+def _picked_first(phonemes, picked):
+    if picked is None:
+        return phonemes
+    return [picked] + [phoneme for phoneme in phonemes if phoneme != picked]
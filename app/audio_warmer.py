@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+
+from app.matcha_utils import (
+    SCHEDULER, audio_name, evict_unused_audio, is_synthesized, synthesize_phonemes
+)
+
+# the number of the most used transcriptions from the db whose audio
+# is kept synthesized; 0 disables the warmer
+WARMER_SIZE = int(os.environ.get('AUDIO_WARMER_SIZE', 0))
+# seconds between the rankings of the transcriptions
+WARMER_INTERVAL = float(os.environ.get('AUDIO_WARMER_INTERVAL_S', 600))
+# the share of the time the warmer may spend synthesizing, in (0, 1]
+WARMER_CPU_BUDGET = float(os.environ.get('AUDIO_WARMER_CPU_BUDGET', 0.25))
+# days after which the audio of a phoneme which wasn't played is deleted; 0 keeps it forever
+AUDIO_MAX_AGE = float(os.environ.get('AUDIO_MAX_AGE_DAYS', 30)) * 24 * 3600
+WARMER_BATCH_SIZE = 4
+# seconds between the checks whether the scheduler is idle
+IDLE_POLL_INTERVAL = 0.5
+
+
+class AudioWarmer:
+    '''
+    Synthesizes the audio of the most used transcriptions from the db in advance,
+    in a background thread: the ones looked up the most
+    and, among equally used ones, the most recently changed.
+
+    It only synthesizes when the scheduler has nothing else to do, and sleeps
+    after every batch so that it spends at most `cpu_budget` of the time working.
+    After a change of the lexicon (see rewarm) the new transcriptions are synthesized first.
+    The page plays the db transcriptions from this audio, see text_to_audio_view.
+
+    Every interval it also evicts the audio of phonemes which wasn't played for `max_age`
+    seconds (0 keeps it forever), except for the warmed one; see evict_unused_audio.
+    '''
+
+    def __init__(
+        self, size: int, interval: float, cpu_budget: float, max_age: float = 0,
+        scheduler=SCHEDULER
+    ):
+        if not 0 < cpu_budget <= 1:
+            raise ValueError(f'The CPU budget must be in (0, 1], got {cpu_budget}')
+        self.size = size
+        self.interval = interval
+        self.cpu_budget = cpu_budget
+        self.max_age = max_age
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._changed = set()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.size or self.max_age)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='audio-warmer', daemon=True)
+            self._thread.start()
+
+    def rewarm(self, changes: list[tuple[str, str, str]]):
+        '''
+        changes: (grapheme, from_phoneme, to_phoneme), as returned by add_graphemes_and_log.
+        '''
+        if not self.size or not changes:
+            return
+        with self._lock:
+            self._changed.update(to_phoneme for _, _, to_phoneme in changes)
+        self._wakeup.set()
+
+    def _run(self):
+        from app import app
+        from app.db_utils import fetch_most_used_phonemes
+
+        while True:
+            self._wakeup.clear()
+            with self._lock:
+                changed, self._changed = self._changed, set()
+            try:
+                phonemes = list(changed)
+                if self.size:
+                    with app.app_context():
+                        phonemes += fetch_most_used_phonemes(self.size)
+                    self._warm(phonemes)
+                if self.max_age:
+                    evict_unused_audio(
+                        self.max_age, keep={audio_name(phoneme) for phoneme in phonemes})
+            except Exception as e:
+                print("Audio warmer error!", e)
+            self._wakeup.wait(self.interval)
+
+    def _warm(self, phonemes: list[str]):
+        missing = [
+            phoneme for phoneme in dict.fromkeys(phonemes)
+            if not is_synthesized(audio_name(phoneme))
+        ]
+        for i in range(0, len(missing), WARMER_BATCH_SIZE):
+            # the lexicon has changed: start over with the new transcriptions
+            if self._wakeup.is_set():
+                return
+            while not self.scheduler.is_idle():
+                time.sleep(IDLE_POLL_INTERVAL)
+            start = time.monotonic()
+            synthesize_phonemes(
+                missing[i:i + WARMER_BATCH_SIZE], scheduler=self.scheduler)
+            spent = time.monotonic() - start
+            time.sleep(spent * (1 - self.cpu_budget) / self.cpu_budget)
+
+
+AUDIO_WARMER = AudioWarmer(
+    WARMER_SIZE, WARMER_INTERVAL, WARMER_CPU_BUDGET, max_age=AUDIO_MAX_AGE)
@@ -0,0 +1,67 @@
+import os
+
+import click
+from flask import current_app
+
+from app.utils import count_word2phones_from_corpus, sort_by_frequency
+
+
+@click.command('ingest-corpus')
+@click.argument('source', type=click.Path(exists=True))
+@click.option(
+    '--jobs', type=int, default=os.cpu_count(),
+    help='Number of processes parsing TextGrids.')
+@click.option(
+    '--output', type=click.File('w', encoding='utf8'), default='-',
+    help='Where to write the review batch (stdout by default).')
+def ingest_corpus_command(source, jobs, output):
+    '''
+    Counts word transcriptions in a directory or a zip archive of TextGrids,
+    saves the counts to the stats table and writes the words which are not in the database yet as one review batch:
+    a tab-separated line per word, the most frequent words and transcriptions first.
+    '''
+    from app import db
+    from app.db_utils import filter_out_existing_words, save_variant_stats
+
+    word2stats, failed_files = count_word2phones_from_corpus(source, num_jobs=jobs)
+    # ingesting the same corpus again replaces its stats
+    save_variant_stats(word2stats, source=f'corpus:{os.path.abspath(source)}')
+    db.session.commit()
+
+    new_word2stats = filter_out_existing_words(word2stats)
+    for word, phones in sort_by_frequency(new_word2stats).items():
+        stats = new_word2stats[word]
+        variants = '\t'.join(f'{phone}:{stats.counts[phone]}' for phone in phones)
+        output.write(f'{word}\t{stats.total()}\t{variants}\n')
+
+    click.echo(
+        f'{len(new_word2stats)} new words out of {len(word2stats)}.', err=True)
+    if failed_files:
+        click.echo(
+            f'Could not parse {len(failed_files)} files: {", ".join(failed_files)}',
+            err=True)
+
+
+@click.command('serve-tts')
+@click.option(
+    '--workers', type=int, default=None,
+    help='Number of processes with a model replica (TTS_SERVER_WORKERS by default).')
+@click.option(
+    '--threads', type=int, default=1,
+    help='Number of torch threads of every process.')
+def serve_tts_command(workers, threads):
+    '''
+    Runs the TTS inference server on the unix socket from TTS_SERVER_ADDRESS.
+    The web app started with the same TTS_SERVER_ADDRESS doesn't load matcha
+    and sends its synthesis batches to the server.
+    '''
+    from app.inference_server import inference_authkey, serve
+    from app.load_models import TTS_SERVER_ADDRESS, TTS_SERVER_WORKERS
+
+    if not TTS_SERVER_ADDRESS:
+        raise click.UsageError('Set TTS_SERVER_ADDRESS to the path of the socket')
+    try:
+        authkey = inference_authkey(current_app.config['SECRET_KEY'])
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    serve(TTS_SERVER_ADDRESS, workers or TTS_SERVER_WORKERS, threads, authkey=authkey)
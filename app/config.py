@@ -1,7 +1,13 @@
 import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+DEFAULT_SECRET_KEY = 'you-will-never-guess'
+
 class Config:
-    SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
+    SECRET_KEY = os.environ.get('SECRET_KEY') or DEFAULT_SECRET_KEY
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
-        'sqlite:///' + os.path.join(basedir, 'app.db')
\ No newline at end of file
+        'sqlite:///' + os.path.join(basedir, 'app.db')
+    # uploads bigger than this are rejected before their body is read
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_SIZE_MB', 100)) * 1024 * 1024
+    # the TextGrids of an uploaded zip archive together, unpacked
+    MAX_UNZIPPED_SIZE = int(os.environ.get('MAX_UNZIPPED_SIZE_MB', 500)) * 1024 * 1024
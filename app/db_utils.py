@@ -1,10 +1,23 @@
+from datetime import datetime, timedelta
+import json
+import secrets
+
+from sqlalchemy import func, tuple_
+
 from app import db
-from app.models import Grapheme, GraphemeLog
+from app.models import Draft, Grapheme, GraphemeLog, PronunciationVariant
+
+# sqlite's default limit of variables in a query is 999
+MAX_IN_CLAUSE_SIZE = 900
+# a draft which wasn't used for this long is deleted
+DRAFT_TTL = timedelta(hours=24)
 
 
 def add_graphemes_and_log(grapheme2phoneme: dict[str, str]):
     # it would probably be better to split add grapheme and add log into two functions
     # but it's more cumbersome to do so
+    # returns the changes: (grapheme, from_phoneme, to_phoneme), from_phoneme is None for new graphemes
+    changes = []
     graphemes = (
         db.session.query(
             Grapheme.id, Grapheme.grapheme, Grapheme.phoneme)
@@ -29,14 +42,17 @@ def add_graphemes_and_log(grapheme2phoneme: dict[str, str]):
                 ({Grapheme.phoneme: phoneme}, synchronize_session=False))
             
             grapheme_log = _create_grapheme_log(grapheme_id, grapheme, phoneme, from_phoneme)
+            changes.append((grapheme, current_phoneme, phoneme))
 
         else:
             grapheme = Grapheme(grapheme=grapheme, phoneme=phoneme)
             db.session.add(grapheme)
             db.session.flush()
             grapheme_log = _create_grapheme_log(grapheme.id, grapheme.grapheme, grapheme.phoneme)
+            changes.append((grapheme.grapheme, None, grapheme.phoneme))
 
         db.session.add(grapheme_log)
+    return changes
 
 
 def fetch_grapheme2phoneme(graphemes: list[str]):
@@ -48,21 +64,79 @@ def fetch_grapheme2phoneme(graphemes: list[str]):
     return grapheme2phoneme
 
 
-def fetch_grapheme_logs(grapheme_id: int):
-    return (
+def count_lookups(graphemes: list[str]):
+    (Grapheme.query
+     .filter(Grapheme.grapheme.in_(graphemes))
+     .update(
+        {Grapheme.lookup_count: Grapheme.lookup_count + 1}, synchronize_session=False))
+
+
+def fetch_most_used_phonemes(limit: int) -> list[str]:
+    '''
+    The transcriptions from the db which are looked up the most;
+    among equally used ones, the most recently changed first.
+    '''
+    last_change = (
+        db.session.query(
+            GraphemeLog.grapheme_id,
+            func.max(GraphemeLog.date_modified).label('date_modified'))
+        .group_by(GraphemeLog.grapheme_id)
+        .subquery()
+    )
+    rows = (
+        db.session.query(Grapheme.phoneme)
+        .outerjoin(last_change, last_change.c.grapheme_id == Grapheme.id)
+        .order_by(Grapheme.lookup_count.desc(), last_change.c.date_modified.desc())
+        .limit(limit)
+    )
+    return list(dict.fromkeys(row.phoneme for row in rows))
+
+
+def fetch_grapheme_logs(
+    grapheme_id: int, limit: int, before: tuple[datetime, int] = None
+):
+    '''
+    Fetches one page of the grapheme history, newest first.
+    Keyset pagination: `before` is the (date_modified, id) of the last log
+    on the previous page, so every page is a range scan
+    over the (grapheme_id, date_modified) index.
+
+    Returns the logs and the key of the next page (None if it's the last one).
+    '''
+    query = (
         db.session.query(
+            GraphemeLog.id,
             GraphemeLog.grapheme_name,
             GraphemeLog.from_phoneme,
             GraphemeLog.to_phoneme,
             GraphemeLog.date_modified)
         .filter(GraphemeLog.grapheme_id == grapheme_id)
-        .order_by(GraphemeLog.date_modified.desc())
+    )
+    if before is not None:
+        before_date, before_id = before
+        query = query.filter(
+            tuple_(GraphemeLog.date_modified, GraphemeLog.id)
+            < tuple_(before_date, before_id)
+        )
+    # fetch one extra row to know if there is a next page
+    logs = (
+        query
+        .order_by(GraphemeLog.date_modified.desc(), GraphemeLog.id.desc())
+        .limit(limit + 1)
         .all()
     )
+    next_key = None
+    if len(logs) > limit:
+        logs = logs[:limit]
+        next_key = (logs[-1].date_modified, logs[-1].id)
+    return logs, next_key
 
 
 def fetch_grapheme(grapheme_id: int):
-    grapheme = Grapheme.query.get(grapheme_id)
+    '''
+    The word and its transcription; aborts with a 404 if there is no such grapheme.
+    '''
+    grapheme = db.get_or_404(Grapheme, grapheme_id)
     return grapheme.grapheme, grapheme.phoneme
 
 
@@ -87,13 +161,12 @@ def fetch_grapheme_ids_by_name(graphemes: list):
 
 
 def filter_out_existing_words(word2phones: dict[str, list[str]]):
-    existing_words = set(
-        row.grapheme for row in
-        (
-            db.session.query(Grapheme.grapheme)
-            .filter(Grapheme.grapheme.in_(word2phones.keys()))
-        )
-    )
+    query = db.session.query(Grapheme.grapheme)
+    # a big batch (e.g. from a corpus) doesn't fit into one IN clause,
+    # so the whole lexicon is read into a set in one query instead
+    if len(word2phones) <= MAX_IN_CLAUSE_SIZE:
+        query = query.filter(Grapheme.grapheme.in_(word2phones.keys()))
+    existing_words = set(row.grapheme for row in query)
     return {
         word: phones 
         for word, phones in word2phones.items() 
@@ -141,3 +214,70 @@ def save_word2phones(word2phones: dict[str, str]):
             
         grapheme_log = _create_grapheme_log(grapheme.id, grapheme.grapheme, grapheme.phoneme)
         db.session.add(grapheme_log)
+
+
+def save_variant_stats(word2stats: dict, source: str):
+    '''
+    Saves counts and durations of transcriptions from an ingested corpus
+    to the stats table; takes a dict word-to-VariantStats.
+    The stats saved before from the same source are replaced.
+    '''
+    PronunciationVariant.query.filter_by(source=source).delete()
+    db.session.add_all(
+        PronunciationVariant(
+            word=word, variant=variant, source=source,
+            count=count, total_duration=stats.durations[variant])
+        for word, stats in word2stats.items()
+        for variant, count in stats.counts.items()
+    )
+
+
+def fetch_variant_counts(words: list[str]) -> dict[str, dict[str, int]]:
+    # summed over all the ingested corpora
+    word2variant_counts = {}
+    rows = (
+        db.session.query(
+            PronunciationVariant.word,
+            PronunciationVariant.variant,
+            func.sum(PronunciationVariant.count).label('count'))
+        .filter(PronunciationVariant.word.in_(words))
+        .group_by(PronunciationVariant.word, PronunciationVariant.variant)
+    )
+    for row in rows:
+        word2variant_counts.setdefault(row.word, {})[row.variant] = row.count
+    return word2variant_counts
+
+
+def fetch_draft(token: str):
+    '''
+    Returns the payload of the draft, or None if there is no such draft
+    or it has expired.
+    '''
+    if not token:
+        return None
+    draft = (
+        Draft.query
+        .filter(Draft.token == token)
+        .filter(Draft.date_modified >= datetime.utcnow() - DRAFT_TTL)
+        .first()
+    )
+    return json.loads(draft.payload) if draft else None
+
+
+def save_draft(payload: dict, token: str = None) -> str:
+    '''
+    Saves the payload to the draft with the token, or to a new draft
+    if there is no token (the expired drafts are deleted then).
+    Returns the token of the draft.
+    '''
+    draft = Draft.query.filter(Draft.token == token).first() if token else None
+    if draft is None:
+        (Draft.query
+         .filter(Draft.date_modified < datetime.utcnow() - DRAFT_TTL)
+         .delete(synchronize_session=False))
+        draft = Draft(token=secrets.token_urlsafe(16))
+        db.session.add(draft)
+    draft.payload = json.dumps(payload, ensure_ascii=False)
+    # onupdate doesn't fire if the payload hasn't changed
+    draft.date_modified = datetime.utcnow()
+    return draft.token
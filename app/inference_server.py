@@ -0,0 +1,117 @@
+from multiprocessing.connection import AuthenticationError, Client, Listener
+import multiprocessing as mp
+import os
+import signal
+
+from app.config import DEFAULT_SECRET_KEY
+
+
+class InferenceClient:
+    '''
+    Thin client of the inference server: can be used as the synthesise_batch
+    function of a SynthesisScheduler. Every batch is sent over a new connection,
+    so any idle server process picks it up.
+    '''
+
+    def __init__(self, address: str, authkey: bytes = None):
+        self.address = address
+        self.authkey = authkey
+
+    def synthesise_batch(self, phonemized_texts: list[str]) -> list[dict]:
+        with Client(self.address, family='AF_UNIX', authkey=self.authkey) as connection:
+            connection.send(list(phonemized_texts))
+            status, result = connection.recv()
+        if status == 'error':
+            raise RuntimeError(f'Inference server: {result}')
+        return result
+
+
+def inference_authkey(secret_key: str) -> bytes:
+    '''
+    The key the server and its clients authenticate each other with: the app's SECRET_KEY.
+    Raises ValueError if it's unset or the default one, which anyone can look up.
+    '''
+    if not secret_key or secret_key == DEFAULT_SECRET_KEY:
+        raise ValueError(
+            'Set SECRET_KEY to a secret value to use the TTS inference server')
+    return secret_key.encode()
+
+
+def serve(address: str, num_workers: int, num_threads: int, authkey: bytes):
+    '''
+    Runs the inference server on a unix socket until it's interrupted.
+    The server is `num_workers` forked processes, each with its own replica of matcha
+    and the vocoder and `num_threads` torch threads pinned to their own cores
+    (if there are enough of them). All of them accept connections on the same socket;
+    a connection is one batch: a list of phonemized strings
+    answered with the outputs of synthesise_batch. The socket is only accessible
+    to its owner, and the clients must authenticate with the authkey.
+    '''
+    if os.path.exists(address):
+        # a socket left by a server which wasn't shut down cleanly
+        os.remove(address)
+    # only the user running the server can connect to the socket
+    umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family='AF_UNIX', authkey=authkey)
+    finally:
+        os.umask(umask)
+    cores = sorted(os.sched_getaffinity(0))
+    context = mp.get_context('fork')
+    workers = []
+    for i in range(num_workers):
+        worker_cores = cores[i * num_threads:(i + 1) * num_threads]
+        if len(worker_cores) < num_threads:
+            worker_cores = None
+        worker = context.Process(
+            target=_worker_loop, args=(listener, num_threads, worker_cores),
+            name=f'inference-worker-{i}', daemon=True)
+        worker.start()
+        workers.append(worker)
+    print(f'Inference server: {num_workers} workers listening on {address}')
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        listener.close()
+
+
+def _worker_loop(listener: Listener, num_threads: int, cores: list[int] = None):
+    # the parent handles ctrl+c and terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cores:
+        os.sched_setaffinity(0, cores)
+
+    import torch
+    from app.load_models import load_matcha
+    from app.matcha_utils import synthesise_batch
+
+    torch.set_num_threads(num_threads)
+    model, vocoder, denoiser = load_matcha()
+
+    while True:
+        try:
+            connection = listener.accept()
+        except (AuthenticationError, OSError) as e:
+            print(f'Inference server: rejected a connection: {e}')
+            continue
+        with connection:
+            try:
+                phonemized_texts = connection.recv()
+            except EOFError:
+                continue
+            try:
+                outputs = synthesise_batch(
+                    phonemized_texts, model=model, vocoder=vocoder, denoiser=denoiser)
+                response = ('ok', outputs)
+            except Exception as e:
+                response = ('error', f'{type(e).__name__}: {e}')
+            try:
+                connection.send(response)
+            except OSError:
+                # the client has gone
+                pass
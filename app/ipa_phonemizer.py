@@ -1,92 +1,206 @@
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import re
 import typing as t
 
-from app.mfa_g2p.generator import PyniniWordListGenerator
-from app.load_models import G2P
+from app.phone_mapping import map_phones
+from app.single_flight import SingleFlight
+
+if t.TYPE_CHECKING:
+    from app.mfa_g2p.generator import PyniniServingGenerator
 
 
 PUNCTUATION_STR = r"[!,.\"#$%&\(\)*+:;<=>?@^_`\{|\}~]"
-PUNCT_PATTERN = re.compile(r"\s+(?=" + PUNCTUATION_STR + ")")
-TOK_PATTERN = re.compile(f"\w+'?-?\w*|{PUNCTUATION_STR}")
+TOK_PATTERN = re.compile(rf"(?P<word>\w+'?-?\w*)|(?P<punct>{PUNCTUATION_STR})")
+
+# token kinds: words are phonemized, punctuation is attached to the previous token,
+# other tokens (e.g. numbers) are passed as they are
+WORD, PUNCT, OTHER = 'word', 'punct', 'other'
+Token = namedtuple('Token', ['text', 'kind', 'start', 'end'])
+# punctuation which ends a chunk of a long text; the chunks are synthesized separately
+SENTENCE_END = {'.', '!', '?', ';', ':'}
+# a chunk with this many words is also split at a comma
+COMMA_CHUNK_WORDS = 12
+# a chunk never has more words than this, even without any punctuation
+MAX_CHUNK_WORDS = 20
+# concurrent requests for the same word wait for one G2P search
+G2P_FLIGHTS = SingleFlight()
 
 
 def tokenize(text: str) -> list[str]:
     """Tokenize a string"""
-    return re.findall(TOK_PATTERN, text.lower())
+    return [token.text for token in tokenize_with_spans(text)]
+
+
+def tokenize_with_spans(text: str) -> list[Token]:
+    '''
+    Tokenizes a string in one pass. Every token is lowercased and typed once
+    (WORD, PUNCT or OTHER); start and end are its span in the original text.
+    '''
+    tokens = []
+    for match in TOK_PATTERN.finditer(text):
+        token = match.group().lower()
+        if match.lastgroup == 'punct':
+            kind = PUNCT
+        elif is_word(token):
+            kind = WORD
+        else:
+            kind = OTHER
+        tokens.append(Token(token, kind, match.start(), match.end()))
+    return tokens
+
+
+def split_into_chunks(tokens: list[Token]) -> list[list[Token]]:
+    '''
+    Splits the tokens of a text into sentences: after a sentence-ending punctuation token,
+    after a comma if the sentence has COMMA_CHUNK_WORDS words already,
+    or after MAX_CHUNK_WORDS words.
+    The punctuation which follows the end (e.g. 'wait...!') stays in the sentence.
+    '''
+    chunks = [[]]
+    num_words = 0
+    is_ended = False
+    for token in tokens:
+        if is_ended and token.kind != PUNCT:
+            chunks.append([])
+            num_words = 0
+            is_ended = False
+        chunks[-1].append(token)
+        if token.kind == WORD:
+            num_words += 1
+            if num_words >= MAX_CHUNK_WORDS:
+                is_ended = True
+        elif token.kind == PUNCT and num_words and (
+            token.text in SENTENCE_END
+            or (token.text == ',' and num_words >= COMMA_CHUNK_WORDS)
+        ):
+            is_ended = True
+    return [chunk for chunk in chunks if chunk]
 
 
 def get_grapheme2phonemes_from_model(
-    word_list: list, g2p: PyniniWordListGenerator=G2P
+    word_list: list, g2p: 'PyniniServingGenerator' = None,
+    phone2symbols: dict[str, str] = None
 ) -> dict[str, list[str]]:
     '''
-    Converts text to a phonetized text, using the G2P model.
-    Returns a dict with the word as a key and a list of phonemes as a value.
+    Converts text to a phonetized text, using the G2P model
+    (the one loaded by app.load_models by default).
+    The phones are mapped to matcha's symbols with the table built at model load.
+    Returns a dict with the word as a key and a list of phonemes as a value,
+    the model's best phoneme (the lowest cost) first.
     '''
+    if g2p is None:
+        from app.load_models import G2P as g2p
+    if phone2symbols is None:
+        from app.load_models import G2P_PHONE2SYMBOLS as phone2symbols
     word2phonemes = dict()  
     for word in word_list:
         # handle words like hel-loh or 'ello, but don't phonemize punctuation
         if not is_word(word):
             word2phonemes[word] = [word]
         else:
-            phonemized = g2p.rewriter(word)
-            phonemized = [collapse_whitespaces(pho) for pho in phonemized]
-            word2phonemes[word] = phonemized
+            candidates = G2P_FLIGHTS.do(
+                (id(g2p), word), lambda: _g2p_candidates(word, g2p, phone2symbols))
+            # every caller gets a list of its own: the lists are extended later
+            word2phonemes[word] = list(candidates)
     return word2phonemes
 
 
+def _g2p_candidates(word, g2p, phone2symbols):
+    with g2p.pooled_rewriter() as rewriter:
+        scored = rewriter.scored(word)
+    # different phones can be mapped to the same symbols: keep the best one
+    return list(dict.fromkeys(map_phones(pho, phone2symbols) for pho, _ in scored))
+
+
 def enrich_model_phonemes_with_db(
         word2model_phonemes: dict[str, list],
-        word2db_phoneme: dict[str, str]
+        word2db_phoneme: dict[str, str],
+        word2variant_counts: dict[str, dict[str, int]] = None,
 ):
     '''
     Takes:
       a dict with words as keys and a list of phonemes as values, 
         generated by G2P model;
-      a dict word-to-phoneme from db.
+      a dict word-to-phoneme from db;
+      optionally, a dict word-to-{phoneme: count} from the ingested corpora.
+
+    Ranks the phonemes of each word by their frequency in the corpora
+    (the phonemes which only occur in the corpora are added too).
         
     Pickes one phoneme for each word: the one from the db if it exists,
-        the first one from the model otherwise.
+        the first one (the most frequent, or the model's best) otherwise;
+        a word without any phoneme has no picked one.
 
     Returns:
       the enriched dict and a dict with the picked phonemes.
     '''
+    word2variant_counts = word2variant_counts or {}
     word2picked_phoneme = {}
     for word, phonemes in word2model_phonemes.items():
+        variant_counts = word2variant_counts.get(word)
+        if variant_counts:
+            phonemes.extend(
+                variant for variant in variant_counts if variant not in phonemes)
+            # sort is stable, so the model's order breaks the ties
+            phonemes.sort(key=lambda phoneme: variant_counts.get(phoneme, 0), reverse=True)
         db_phoneme = word2db_phoneme.get(word)
         if db_phoneme:
             word2picked_phoneme[word] = db_phoneme
             if db_phoneme not in phonemes:
                 word2model_phonemes[word].append(db_phoneme)
-        else:
+        elif phonemes:
             word2picked_phoneme[word] = phonemes[0]
+        # else: the model has no pronunciation of the word (e.g. unknown graphemes),
+        # nothing is picked
     return word2model_phonemes, word2picked_phoneme
 
 
 def phonemes_to_string(
-    word_list: list[str], word2picked_phoneme: dict[str, str]
+    tokens: list[Token], word2picked_phoneme: dict[str, str]
 ) -> str:
-    phonemes = [word2picked_phoneme.get(word, '') for word in word_list]
-    # removes whitespaces before punctuation and joins the phonemes
-    return re.sub(PUNCT_PATTERN, "", " ".join(phonemes))
+    return phonemes_to_string_with_spans(tokens, word2picked_phoneme)[0]
+
+
+def phonemes_to_string_with_spans(
+    tokens: list[Token], word2picked_phoneme: dict[str, str]
+) -> tuple[str, list[tuple[str, int, int]]]:
+    '''
+    Joins the picked phonemes of the words into one string; punctuation and other tokens
+    (e.g. numbers) are written as they are, so the string of a sentence
+    doesn't depend on whether they are in word2picked_phoneme.
+    Also returns (phoneme, start, end) of every word: where its phoneme is in the string.
+    '''
+    parts = []
+    word_spans = []
+    length = 0
+    for token in tokens:
+        # no whitespace before punctuation
+        if parts and token.kind != PUNCT:
+            parts.append(' ')
+            length += 1
+        if token.kind == WORD:
+            phoneme = word2picked_phoneme.get(token.text, '')
+            if phoneme:
+                word_spans.append((phoneme, length, length + len(phoneme)))
+        else:
+            phoneme = token.text
+        parts.append(phoneme)
+        length += len(phoneme)
+    return ''.join(parts), word_spans
 
 
 def phonemize(
-    word_list: list[str],
+    tokens: list[Token],
     word2model_phonemes: dict[str, list],
     word2db_phoneme: dict[str, str],
+    word2variant_counts: dict[str, dict[str, int]] = None,
 ) -> tuple[dict[str, list], dict[str, str], str]:
     word2phonemized, word2picked_phoneme = enrich_model_phonemes_with_db(
-        word2model_phonemes, word2db_phoneme)
-    phonemized_str = phonemes_to_string(word_list, word2picked_phoneme)
+        word2model_phonemes, word2db_phoneme, word2variant_counts)
+    phonemized_str = phonemes_to_string(tokens, word2picked_phoneme)
     return word2phonemized, word2picked_phoneme, phonemized_str
 
 
-def collapse_whitespaces(phoneme: str) -> str:
-    # 'h ɛ l l o ʊ' => 'hɛlloʊ'
-    return phoneme.replace(" ", "")
-
-
 def is_word(word: str) -> bool:
     # handle words like hel-loh or 'ello, but don't phonemize punctuation
     return word.replace('-', '').replace('\'', '').isalpha()
@@ -31,14 +31,24 @@ from matcha.hifigan.env import AttrDict
 from matcha.hifigan.models import Generator as HiFiGAN
 # Matcha imports
 from matcha.models.matcha_tts import MatchaTTS
+from matcha.text.symbols import symbols
 from matcha.utils.utils import get_user_data_dir
 # G2P imports
-from app.mfa_g2p.generator import PyniniWordListGenerator
+from app.mfa_g2p.generator import PyniniServingGenerator
+from app.phone_mapping import build_phone_mapping
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 MATCHA_CHECKPOINT = get_user_data_dir()/"matcha_ljspeech.ckpt"
 HIFIGAN_CHECKPOINT = get_user_data_dir() / "hifigan_T2_v1"
 G2P_CHECKPOINT= os.path.join("app", "mfa_g2p", "pretrained_models", "english_us_ipa.zip")
+# n-best and beam of the G2P search: at most G2P_NUM_PRONUNCIATIONS candidates
+# (0 is no limit) whose cost is within G2P_BEAM of the best one
+G2P_NUM_PRONUNCIATIONS = int(os.environ.get("G2P_NUM_PRONUNCIATIONS", 0))
+G2P_BEAM = float(os.environ.get("G2P_BEAM", 1.5))
+# with the address of a unix socket, matcha runs in the processes of the inference server
+# (flask serve-tts, see app/inference_server.py) and the web app only sends it batches
+TTS_SERVER_ADDRESS = os.environ.get("TTS_SERVER_ADDRESS")
+TTS_SERVER_WORKERS = int(os.environ.get("TTS_SERVER_WORKERS", 2))
 
 
 def load_matcha_model(checkpoint_path):
@@ -58,14 +68,48 @@ def load_vocoder(checkpoint_path):
 
 def load_g2p():
     '''
-    A simple wrapper around the PyniniWordListGenerator class.
+    A simple wrapper around the PyniniServingGenerator class:
+    the model is read from the archive into memory, nothing is written to disk.
     '''
-    g2p = PyniniWordListGenerator(
-        g2p_model_path=pathlib.Path(G2P_CHECKPOINT))
+    g2p = PyniniServingGenerator(
+        g2p_model_path=pathlib.Path(G2P_CHECKPOINT),
+        num_pronunciations=G2P_NUM_PRONUNCIATIONS,
+        g2p_threshold=G2P_BEAM)
     g2p.setup()
     return g2p
 
 
+def load_phone_mapping(g2p):
+    '''
+    Maps the phones the G2P model can emit to matcha's symbols
+    and reports the ones matcha can't synthesize.
+    '''
+    phone_table = g2p.output_token_type
+    # "utf8": the model has no phone table, its output is matcha's symbols already
+    if isinstance(phone_table, str):
+        return {}
+    phone2symbols, unmappable = build_phone_mapping(phone_table, symbols)
+    print(f"Phone mapping built: {len(phone2symbols)} G2P phones")
+    if unmappable:
+        print(f"G2P phones which can't be mapped to matcha symbols: {sorted(unmappable)}")
+    return phone2symbols
+
+
+def model_version() -> str:
+    '''
+    Identity of the checkpoints of matcha and the vocoder: a part of the audio names,
+    so the audio of replaced checkpoints isn't served from the cache.
+    '''
+    parts = []
+    for path in (MATCHA_CHECKPOINT, HIFIGAN_CHECKPOINT):
+        try:
+            stat = os.stat(path)
+            parts.append(f"{pathlib.Path(path).name}:{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append(pathlib.Path(path).name)
+    return ",".join(parts)
+
+
 def load_matcha():
     count_params = lambda x: f"{sum(p.numel() for p in x.parameters()):,}"
     model = load_matcha_model(MATCHA_CHECKPOINT)
@@ -77,5 +121,10 @@ def load_matcha():
     return model, vocoder, denoiser
 
 
-MATCHA_MODEL, VOCODER, DENOISER = load_matcha()
+if TTS_SERVER_ADDRESS:
+    MATCHA_MODEL = VOCODER = DENOISER = None
+else:
+    MATCHA_MODEL, VOCODER, DENOISER = load_matcha()
+MODEL_VERSION = model_version()
 G2P = load_g2p()
+G2P_PHONE2SYMBOLS = load_phone_mapping(G2P)
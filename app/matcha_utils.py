@@ -2,28 +2,77 @@
 # https://github.com/shivammehta25/Matcha-TTS/blob/256adc55d3219053d2d086db3f9bd9a4bde96fb1/synthesis.ipynb
 
 import datetime as dt
-from functools import cache
+import hashlib
 import os
+import re
+import threading
+import time
 from pathlib import Path
 
-import IPython.display as ipd
 import numpy as np
 import soundfile as sf
 import torch
 from types import SimpleNamespace
 
-from matcha.text import sequence_to_text
 from matcha.text.symbols import symbols
-from matcha.utils.utils import intersperse
 
-from app.ipa_phonemizer import is_word
-from app.load_models import MATCHA_MODEL, VOCODER, DENOISER, DEVICE
+from app.config import Config
+from app.inference_server import InferenceClient, inference_authkey
+from app.single_flight import SingleFlight
+from app.load_models import (
+    MATCHA_MODEL, VOCODER, DENOISER, DEVICE, MODEL_VERSION, TTS_SERVER_ADDRESS,
+    TTS_SERVER_WORKERS
+)
+from app.synthesis_scheduler import SynthesisScheduler
 
 HYPERPARAMS = SimpleNamespace(n_timesteps=10, temperature=1.0, length_scale=0.667)
 OUTPUT_FOLDER = os.path.join('app', 'static', 'audio')
+SAMPLE_RATE = 22050
+# samples per mel frame of matcha and hifigan
+HOP_LENGTH = 256
+# requests from all threads are batched: collected for up to the window,
+# or until there are MAX_BATCH_SIZE of them (padded to the longest one)
+BATCH_WINDOW = float(os.environ.get('SYNTHESIS_BATCH_WINDOW_MS', 10)) / 1000
+MAX_BATCH_SIZE = int(os.environ.get('SYNTHESIS_MAX_BATCH_SIZE', 16))
+# seconds a request waits for its synthesis before it fails
+SYNTHESIS_TIMEOUT = float(os.environ.get('SYNTHESIS_TIMEOUT_S', 120))
+# the longest phonemized string synthesized on its own:
+# a candidate's preview or an item of the synthesize api
+MAX_PHONEME_LENGTH = 100
+# the sentences of a long text fade into each other over this many seconds
+CROSSFADE = 0.02
+AUDIO_NAME_PATTERN = re.compile(r'(utterance_|clip_)?[0-9a-f]{20}')
+# the audio of a single phoneme: the only one which can be synthesized again from its url
+PHONEME_AUDIO_NAME_PATTERN = re.compile(r'[0-9a-f]{20}')
+# the wav is the synthesized original; the other formats are encoded from it
+# on their first request and saved next to it. Format: (mimetype, soundfile format, subtype)
+AUDIO_FORMATS = {
+    'ogg': ('audio/ogg', 'OGG', 'VORBIS'),
+    'mp3': ('audio/mpeg', 'MP3', 'MPEG_LAYER_III'),
+    'wav': ('audio/wav', 'WAV', 'PCM_24'),
+}
+# the formats the audio is served in, the preferred one first; wav is always the last resort.
+# The ones the installed libsndfile can't write are left out (e.g. mp3 before 1.1)
+SERVED_AUDIO_FORMATS = [
+    audio_format
+    for audio_format in os.environ.get('AUDIO_FORMATS', 'ogg,mp3').split(',')
+    if audio_format in AUDIO_FORMATS and audio_format != 'wav'
+    and AUDIO_FORMATS[audio_format][1] in sf.available_formats()
+    and AUDIO_FORMATS[audio_format][2] in sf.available_subtypes(AUDIO_FORMATS[audio_format][1])
+] + ['wav']
+AUDIO_ENCODER_WORKERS = int(os.environ.get('AUDIO_ENCODER_WORKERS', 2))
 
 
-def phonemized_to_sequence(phonemized_text):
+# symbols are single characters, so a phonemized string is encoded
+# by indexing a codepoint-to-id table with the string's codepoints
+CODEPOINT_TO_ID = np.full(max(map(ord, symbols)) + 1, -1, dtype=np.int64)
+CODEPOINT_TO_ID[[ord(s) for s in symbols]] = np.arange(len(symbols))
+# what to do with symbols matcha doesn't know:
+# 'skip' drops them with a warning, 'error' raises a ValueError
+UNKNOWN_SYMBOL_POLICY = 'skip'
+
+
+def phonemized_to_sequence(phonemized_text, unknown_policy=UNKNOWN_SYMBOL_POLICY):
     """
     ### 
     Caution: Copied from matcha.text.__init__ with modifications in order to replace
@@ -34,136 +83,381 @@ def phonemized_to_sequence(phonemized_text):
     Converts a string of phonemized text to a sequence of IDs corresponding to the symbols in the text.
     Args:
       phonemized_text: phonemized string to convert to a sequence
+      unknown_policy: 'skip' or 'error', see UNKNOWN_SYMBOL_POLICY
     Returns:
-      List of integers corresponding to the symbols in the text
+      numpy array of integers corresponding to the symbols in the text
     """
-    _symbol_to_id = {s: i for i, s in enumerate(symbols)}
-    sequence = []
-
-    for symbol in phonemized_text:
-        symbol_id = _symbol_to_id[symbol]
-        sequence += [symbol_id]
+    codepoints, sequence = lookup_symbol_ids(phonemized_text)
+    unknown = sequence < 0
+    if unknown.any():
+        unknown_symbols = sorted(set(map(chr, codepoints[unknown])))
+        if unknown_policy == 'error':
+            raise ValueError(
+                f'Unknown symbols in "{phonemized_text}": {unknown_symbols}')
+        print(f'Skipping unknown symbols in "{phonemized_text}": {unknown_symbols}')
+        sequence = sequence[~unknown]
     return sequence
 
 
-@torch.inference_mode()
-def process_text(text: str, phonemized_text: str):
-    sequence = phonemized_to_sequence(phonemized_text)
-    x = torch.tensor(
-        intersperse(sequence, 0),
-        dtype=torch.long,
-        device=DEVICE)[None]
-    x_lengths = torch.tensor([x.shape[-1]],dtype=torch.long, device=DEVICE)
-    x_phones = sequence_to_text(x.squeeze(0).tolist())
-    return {
-        'x_orig': text,
-        'x': x,
-        'x_lengths': x_lengths,
-        'x_phones': x_phones
-    }
+def lookup_symbol_ids(phonemized_text):
+    '''
+    Returns the codepoints of the string and the ids of its symbols (-1 for unknown ones),
+    one per character.
+    '''
+    codepoints = np.frombuffer(
+        phonemized_text.encode('utf-32-le'), dtype='<u4').astype(np.int64)
+    in_table = codepoints < len(CODEPOINT_TO_ID)
+    ids = np.full(len(codepoints), -1, dtype=np.int64)
+    ids[in_table] = CODEPOINT_TO_ID[codepoints[in_table]]
+    return codepoints, ids
+
+
+def intersperse_blank(sequence, blank=0):
+    '''
+    Vectorized matcha.utils.utils.intersperse: [a, b] -> [0, a, 0, b, 0]
+    '''
+    result = np.full(len(sequence) * 2 + 1, blank, dtype=np.int64)
+    result[1::2] = sequence
+    return result
+
+
+def save_wav(filename: str, waveform, folder: str):
+    folder = Path(folder)
+    folder.mkdir(exist_ok=True, parents=True)
+    # the wav is the cache entry: write it under a temporary name and rename it,
+    # so other processes never see a half-written file
+    tmp_path = folder / f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+    sf.write(tmp_path, waveform, SAMPLE_RATE, 'PCM_24', format='WAV')
+    os.replace(tmp_path, folder / f'{filename}.wav')
+    return folder / f'{filename}.wav'
+
+
+def audio_name(phonemized: str, utterance=False, clip_of: str = None) -> str:
+    '''
+    Name of the audio of a phonemized string. Unlike hash(), it is the same
+    in every process and after restarts, so the saved file itself is the cache.
+    The hyperparameters and the checkpoints (MODEL_VERSION) are a part of the key:
+    changing them invalidates the audios.
+    A clip cut from a sentence (clip_of: the sentence's audio name) sounds different
+    from the word synthesized on its own, so it has a name of its own.
+    '''
+    key = f'{phonemized}|{HYPERPARAMS}|{MODEL_VERSION}'
+    if clip_of is not None:
+        key = f'{key}|{clip_of}'
+    digest = hashlib.sha1(key.encode()).hexdigest()[:20]
+    if clip_of is not None:
+        return f'clip_{digest}'
+    return f'utterance_{digest}' if utterance else digest
+
+
+def is_synthesized(name: str, output_folder=OUTPUT_FOLDER) -> bool:
+    return os.path.exists(os.path.join(output_folder, f'{name}.wav'))
+
+
+def evict_unused_audio(
+    max_age: float, keep: set[str] = frozenset(), output_folder=OUTPUT_FOLDER
+) -> int:
+    '''
+    Deletes the audio of single phonemes (see synthesize_phonemes), in every format,
+    which wasn't used for max_age seconds, except for the names in `keep`.
+    Only these are deleted: their preview url synthesizes them again,
+    while the audio of sentences and their clips is only reachable by its immutable url.
+    The last use is the mtime of the wav, see synthesize_phonemes.
+    Returns the number of deleted audios.
+    '''
+    oldest = time.time() - max_age
+    num_deleted = 0
+    try:
+        entries = list(os.scandir(output_folder))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        name, _, extension = entry.name.partition('.')
+        if extension != 'wav' or name in keep or not PHONEME_AUDIO_NAME_PATTERN.fullmatch(name):
+            continue
+        try:
+            if entry.stat().st_mtime >= oldest:
+                continue
+        except FileNotFoundError:
+            continue
+        # the wav goes last: while it's there, the audio counts as synthesized
+        for audio_format in sorted(AUDIO_FORMATS, key=lambda f: f == 'wav'):
+            try:
+                os.remove(os.path.join(output_folder, f'{name}.{audio_format}'))
+            except FileNotFoundError:
+                pass
+        num_deleted += 1
+    return num_deleted
+
+
+def negotiate_audio_format(accept_mimetypes) -> str:
+    '''
+    Picks one of SERVED_AUDIO_FORMATS by the Accept header of a request
+    (request.accept_mimetypes): the one whose mimetype is listed with the highest quality,
+    the preferred one on ties. A wildcard (*/* or audio/*) doesn't say that
+    the client can play a compressed format, so it gets wav, which every browser plays.
+    '''
+    mimetype2quality = {
+        value.split(';')[0].strip().lower(): quality for value, quality in accept_mimetypes}
+
+    def quality(audio_format):
+        return mimetype2quality.get(AUDIO_FORMATS[audio_format][0], 0)
+
+    # max keeps the first of the equally good formats
+    audio_format = max(SERVED_AUDIO_FORMATS, key=quality)
+    return audio_format if quality(audio_format) > 0 else 'wav'
+
+
+def encode_audio(name: str, audio_format: str, output_folder=OUTPUT_FOLDER) -> str:
+    '''
+    Returns the path of the audio in the format. The first request encodes the wav
+    in the encoder pool (concurrent requests wait for it) and saves the result,
+    the next ones get the saved file.
+    Raises FileNotFoundError if the audio wasn't synthesized.
+    '''
+    wav_path = os.path.join(output_folder, f'{name}.wav')
+    if not os.path.exists(wav_path):
+        raise FileNotFoundError(wav_path)
+    path = os.path.join(output_folder, f'{name}.{audio_format}')
+    if os.path.exists(path):
+        return path
+
+    def encode():
+        _, sf_format, subtype = AUDIO_FORMATS[audio_format]
+        waveform, sample_rate = sf.read(wav_path, dtype='float32')
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            sf.write(tmp_path, waveform, sample_rate, subtype, format=sf_format)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def read_cached():
+        return path if os.path.exists(path) else None
+
+    return ENCODER_FLIGHTS.submit(f'{name}.{audio_format}', encode, read_cached).result()
 
 
 @torch.inference_mode()
-def synthesise(text, phonemized_text, model, args=HYPERPARAMS, spks=None):
-    text_processed = process_text(text, phonemized_text)
-    start_t = dt.datetime.now()
+def synthesise_batch(
+    phonemized_texts: list[str],
+    model=MATCHA_MODEL, vocoder=VOCODER, denoiser=DENOISER,
+    args=HYPERPARAMS, spks=None
+) -> list[dict]:
+    '''
+    Synthesizes several phonemized strings in one padded batch.
+    Returns a dict for each string: its waveform and mel (numpy arrays)
+    and the durations in mel frames of every input symbol (blanks included).
+    '''
+    sequences = [
+        intersperse_blank(phonemized_to_sequence(text)) for text in phonemized_texts]
+    lengths = [len(sequence) for sequence in sequences]
+    x = np.zeros((len(sequences), max(lengths)), dtype=np.int64)
+    for i, sequence in enumerate(sequences):
+        x[i, :len(sequence)] = sequence
+
     output = model.synthesise(
-        text_processed['x'], 
-        text_processed['x_lengths'],
+        torch.from_numpy(x).to(DEVICE),
+        torch.tensor(lengths, dtype=torch.long, device=DEVICE),
         n_timesteps=args.n_timesteps,
         temperature=args.temperature,
         spks=spks,
         length_scale=args.length_scale
     )
-    # merge everything to one dict    
-    output.update({'start_t': start_t, **text_processed})
-    return output
+    mels = output['mel']
+    waveforms = vocoder(mels).clamp(-1, 1)
+    waveforms = denoiser(waveforms.squeeze(1), strength=0.00025)
+    waveforms = waveforms.reshape(len(sequences), -1).cpu().numpy()
+    mels = mels.cpu().numpy()
+    mel_lengths = output['mel_lengths'].cpu().numpy()
+    # attn: batch x 1 x symbols x frames, every frame is aligned to one symbol
+    durations = output['attn'].squeeze(1).sum(-1).cpu().numpy()
 
+    return [
+        {
+            'waveform': waveforms[i, :mel_lengths[i] * HOP_LENGTH],
+            'mel': mels[i, :, :mel_lengths[i]],
+            'durations': durations[i, :lengths[i]],
+        }
+        for i in range(len(sequences))
+    ]
 
-@torch.inference_mode()
-def to_waveform(mel, vocoder, denoiser):
-    audio = vocoder(mel).clamp(-1, 1)
-    audio = denoiser(audio.squeeze(0), strength=0.00025).cpu().squeeze()
-    return audio.cpu().squeeze()
-    
 
-def save_to_folder(filename: str, output: dict, folder: str):
-    folder = Path(folder)
-    folder.mkdir(exist_ok=True, parents=True)
-    np.save(folder / f'{filename}', output['mel'].cpu().numpy())
-    sf.write(folder / f'{filename}.wav', output['waveform'], 22050, 'PCM_24')
-    return folder / f'{filename}.wav'
+if TTS_SERVER_ADDRESS:
+    # a batch in flight for every process of the inference server
+    SCHEDULER = SynthesisScheduler(
+        InferenceClient(TTS_SERVER_ADDRESS, inference_authkey(Config.SECRET_KEY)).synthesise_batch,
+        window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE,
+        num_workers=TTS_SERVER_WORKERS, timeout=SYNTHESIS_TIMEOUT)
+else:
+    SCHEDULER = SynthesisScheduler(
+        synthesise_batch, window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE,
+        timeout=SYNTHESIS_TIMEOUT)
+# concurrent requests for the same audio, from any thread or process, wait for one synthesis;
+# enough threads to fill the batches of all the scheduler's workers
+SYNTHESIS_FLIGHTS = SingleFlight(
+    lock_folder=os.path.join(OUTPUT_FOLDER, '.locks'),
+    max_workers=MAX_BATCH_SIZE * SCHEDULER.num_workers)
+ENCODER_FLIGHTS = SingleFlight(
+    lock_folder=os.path.join(OUTPUT_FOLDER, '.locks'), max_workers=AUDIO_ENCODER_WORKERS)
+
+
+def cut_word_clips(phonemized: str, output: dict, word_spans):
+    '''
+    Cuts the clips of words from a synthesized utterance,
+    using the durations of its symbols.
+    word_spans: (phoneme, start, end) of every word, where start and end
+      are the character span of the word's phoneme in the phonemized string.
+    Yields (phoneme, waveform).
+    '''
+    _, ids = lookup_symbol_ids(phonemized)
+    known = ids >= 0
+    # unknown symbols were skipped: index of each character's symbol in the sequence
+    symbol_index = np.cumsum(known) - 1
+    # symbol k is at position 2k + 1 of the interspersed sequence
+    frame_bounds = np.concatenate([[0], np.cumsum(output['durations'])])
+    for phoneme, start, end in word_spans:
+        word_symbols = symbol_index[start:end][known[start:end]]
+        if not len(word_symbols):
+            continue
+        # from the blank before the first symbol to the blank after the last one
+        start_frame = frame_bounds[2 * word_symbols[0]]
+        end_frame = frame_bounds[2 * word_symbols[-1] + 3]
+        yield phoneme, output['waveform'][
+            int(start_frame) * HOP_LENGTH:int(end_frame) * HOP_LENGTH]
 
 
 def synthesize_matcha_audios(
-    text: str, phonemized: str, word2phonemes: dict[str, list[str]],
-    model=MATCHA_MODEL, vocoder=VOCODER, denoiser=DENOISER, 
-    output_folder=OUTPUT_FOLDER
-):
+    chunks, scheduler=SCHEDULER, output_folder=OUTPUT_FOLDER
+) -> tuple[str, dict[str, str]]:
+    '''
+    Synthesizes a text sentence by sentence.
+    chunks: (phonemized, word_spans) of every sentence, see cut_word_clips.
+    Every sentence is an audio of its own: only the ones which aren't on disk yet
+    are synthesized, in parallel (the scheduler batches them), and the clips
+    of the picked phonemes are cut from them. The sentences are joined with short crossfades.
+    The other candidates are synthesized on demand, see synthesize_phonemes.
+    Returns the audio name of the whole text (None if there is nothing to synthesize)
+    and a dict phoneme-to-audio name of the clips.
+    '''
+    chunks = [(phonemized, word_spans) for phonemized, word_spans in chunks if phonemized.strip()]
+    if not chunks:
+        return None, {}
+    # a text of one sentence is the audio of the sentence
+    utterance_name = audio_name(
+        '\n'.join(phonemized for phonemized, _ in chunks), utterance=True)
+    chunk_names = [audio_name(phonemized, utterance=True) for phonemized, _ in chunks]
+    if is_synthesized(utterance_name, output_folder):
+        return utterance_name, find_clips(chunks, chunk_names, output_folder)
 
-    rtfs = []
-    rtfs_w = []
+    # the same sentence can occur several times
+    name2future = {
+        name: synthesize_once(name, phonemized, word_spans, scheduler, output_folder)
+        for name, (phonemized, word_spans) in zip(chunk_names, chunks)
+    }
+    if len(chunks) > 1:
+        waveforms = [name2future[name].result() for name in chunk_names]
+        save_wav(
+            utterance_name,
+            crossfade_concatenate(waveforms, int(CROSSFADE * SAMPLE_RATE)),
+            output_folder)
+    else:
+        name2future[utterance_name].result()
+    return utterance_name, find_clips(chunks, chunk_names, output_folder)
 
-    # synthesize the whole sentence first -- from user's input
-    rtf, rtf_w, _ = synthesize_matcha_audio(
-        text, phonemized,
-        model=model, vocoder=vocoder, denoiser=denoiser, 
-        output_folder=output_folder,
-        utterance=True,
-    )
 
-    # it's a bit redundant to repeat list.append here
-    # but functools.cache accepts only hashable arguments
-    rtfs.append(rtf)
-    rtfs_w.append(rtf_w)
-    
-    phonemes2audio_names = {}
-    for word, phonemes in word2phonemes.items():
-        if not is_word(word):
-            continue
-        for phoneme in phonemes:
-            rtf, rtf_w, name = synthesize_matcha_audio(
-                word, phoneme,
-                model=model, vocoder=vocoder, denoiser=denoiser, 
-                output_folder=output_folder
-            )
-            rtfs.append(rtf)
-            rtfs_w.append(rtf_w)
-            phonemes2audio_names[phoneme] = name
-
-    print(f"Number of ODE steps: {HYPERPARAMS.n_timesteps}")
-    print(f"Mean RTF:\t\t\t\t{np.mean(rtfs):.6f} ± {np.std(rtfs):.6f}")
-    print(f"Mean RTF Waveform (incl. vocoder):\t{np.mean(rtfs_w):.6f} ± {np.std(rtfs_w):.6f}")
-    print(f'Cache info: {synthesize_matcha_audio.cache_info()}')
-
-    return phonemes2audio_names
-
-
-@cache
-def synthesize_matcha_audio(
-    text: str, phonemized: str,
-    model, vocoder, denoiser, output_folder,
-    utterance=False
+def find_clips(chunks, chunk_names: list[str], output_folder=OUTPUT_FOLDER) -> dict[str, str]:
+    # the clips cut from the sentences which are on disk, the first one of every phoneme
+    phoneme2clip_name = {}
+    for (_, word_spans), chunk_name in zip(chunks, chunk_names):
+        for phoneme, _, _ in word_spans:
+            clip_name = audio_name(phoneme, clip_of=chunk_name)
+            if phoneme not in phoneme2clip_name and is_synthesized(clip_name, output_folder):
+                phoneme2clip_name[phoneme] = clip_name
+    return phoneme2clip_name
+
+
+def synthesize_once(
+    name: str, phonemized: str, word_spans=None,
+    scheduler=SCHEDULER, output_folder=OUTPUT_FOLDER
 ):
-    output = synthesise(text, phonemized, model)
-    output['waveform'] = to_waveform(output['mel'], vocoder, denoiser)
-
-    # Compute Real Time Factor (RTF) with HiFi-GAN
-    t = (dt.datetime.now() - output['start_t']).total_seconds()
-    rtf_w = t * 22050 / (output['waveform'].shape[-1])
-    
-    ## Display the synthesised waveform
-    ipd.display(ipd.Audio(output['waveform'], rate=22050))
-
-    ## Save the generated waveform: with the name 'utterance.wav' if it's a sentence, 
-    ## and to a hash if it's a phonemized word
-    if utterance:
-        name = "utterance"
-    else:
-        name = str(hash(phonemized))
-        
-    save_to_folder(name, output, output_folder)
+    '''
+    Synthesizes and saves the audio of a phonemized string, unless it's on disk already.
+    The clips of the words of sentences (with word_spans) are cut from them;
+    only the wavs are kept, the mels are dropped.
+    A request for an audio which is being synthesized (in any thread or process)
+    waits for it instead. Returns a Future of the waveform.
+    '''
+    def synthesize():
+        start_t = dt.datetime.now()
+        [output] = scheduler.synthesise([phonemized])
+        if word_spans is None:
+            save_wav(name, output['waveform'], output_folder)
+            return output['waveform']
+
+        save_wav(name, output['waveform'], output_folder)
+        for phoneme, clip in cut_word_clips(phonemized, output, word_spans):
+            save_clip(audio_name(phoneme, clip_of=name), clip, output_folder)
+        t = (dt.datetime.now() - start_t).total_seconds()
+        rtf = t * SAMPLE_RATE / max(len(output['waveform']), 1)
+        print(f"RTF (incl. vocoder): {rtf:.6f}, Number of ODE steps: {HYPERPARAMS.n_timesteps}")
+        return output['waveform']
+
+    def read_cached():
+        return read_wav(name, output_folder) if is_synthesized(name, output_folder) else None
+
+    return SYNTHESIS_FLIGHTS.submit(name, synthesize, read_cached)
+
+
+def save_clip(name: str, clip, output_folder=OUTPUT_FOLDER):
+    # like every audio, a clip is written by one thread of one process at a time
+    path = os.path.join(output_folder, f'{name}.wav')
+    SYNTHESIS_FLIGHTS.do(
+        name, lambda: save_wav(name, clip, output_folder),
+        lambda: path if os.path.exists(path) else None)
+
+
+def read_wav(name: str, folder=OUTPUT_FOLDER):
+    waveform, _ = sf.read(os.path.join(folder, f'{name}.wav'), dtype='float32')
+    return waveform
+
+
+def crossfade_concatenate(waveforms: list, overlap: int):
+    '''
+    Joins the waveforms, fading each one into the next over `overlap` samples.
+    '''
+    pieces = [waveforms[0]]
+    for waveform in waveforms[1:]:
+        previous = pieces.pop()
+        n = min(overlap, len(previous), len(waveform))
+        fade_in = np.linspace(0, 1, n, endpoint=False, dtype=np.float32)
+        pieces.append(previous[:len(previous) - n])
+        pieces.append(previous[len(previous) - n:] * (1 - fade_in) + waveform[:n] * fade_in)
+        pieces.append(waveform[n:])
+    return np.concatenate(pieces)
 
-    return output['rtf'], rtf_w, name
 
- 
+def synthesize_phonemes(
+    phonemes: list[str], scheduler=SCHEDULER, output_folder=OUTPUT_FOLDER
+) -> dict[str, str]:
+    '''
+    Synthesizes every distinct phonemized string which isn't on disk yet;
+    they are batched by the scheduler, with the requests of other threads.
+    The audios which are on disk are marked as used, see evict_unused_audio.
+    Returns a dict phoneme-to-audio name.
+    '''
+    phoneme2audio_name = {
+        phoneme: audio_name(phoneme) for phoneme in dict.fromkeys(phonemes)}
+    futures = []
+    for phoneme, name in phoneme2audio_name.items():
+        try:
+            os.utime(os.path.join(output_folder, f'{name}.wav'))
+        except FileNotFoundError:
+            futures.append(synthesize_once(
+                name, phoneme, scheduler=scheduler, output_folder=output_folder))
+    for future in futures:
+        future.result()
+    return phoneme2audio_name
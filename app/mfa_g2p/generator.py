@@ -27,13 +27,18 @@ import abc
 import csv
 import functools
 import itertools
+import json
+import math
 import multiprocessing as mp
 import os
 import shutil
 import queue
 import statistics
+import threading
 import time
 import typing
+import zipfile
+from contextlib import contextmanager
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from typing import Optional, Any, Type, Union, get_type_hints
@@ -55,7 +60,18 @@ from .models import G2PModel
 
 
 Metadict = dict[str, Any]
-TEMPORARY_DIRECTORY = get_temporary_directory()
+# budget of the bounded decoding: a word which is too long is decoded in pieces,
+# and a word whose lattice is too big or took too long to build
+# gets only its best pronunciation
+MAX_WORD_LENGTH = 40
+MAX_LATTICE_STATES = 20000
+WORD_TIME_LIMIT = 0.5
+# maximum number of pronunciations of a multi-word input (e.g. hyphenated compounds)
+MAX_COMBINATIONS = 64
+# number of word acceptors kept by a PhonetisaurusRewriter
+WORD_FST_CACHE_SIZE = 4096
+# maximum number of rewriters shared by the threads of a serving process
+REWRITER_POOL_SIZE = os.cpu_count() or 1
 # Caution: logger has been deleted
 
 def optimal_rewrites(
@@ -80,6 +96,112 @@ def optimal_rewrites(
     return rewrite.lattice_to_strings(lattice, output_token_type)
 
 
+def scored_rewrites(
+    string: pynini.FstLike,
+    rule: pynini.Fst,
+    input_token_type: Optional[pynini.TokenType] = None,
+    output_token_type: Optional[pynini.TokenType] = None,
+    nshortest: int = 0,
+    threshold: float = 1,
+    max_states: Optional[int] = None,
+    time_limit: Optional[float] = None,
+    best_only: bool = False,
+) -> list[tuple[str, float]]:
+    """Returns rewrites with their costs, best first.
+    The costs are read from the same thresholded DFA the strings come from,
+    so scoring doesn't need another search.
+    If the lattice has more than max_states states or building it took longer
+    than time_limit seconds, it isn't determinized and only the best path is returned
+    (the shortest path is linear in the size of the lattice).
+    Determinization can't be interrupted, so it is bounded by states instead of time:
+    it stops at max_states states, and then only the best path is returned too.
+    Args:
+    string: Input string or FST.
+    rule: Input rule WFST.
+    input_token_type: Optional input token type, or symbol table.
+    output_token_type: Optional output token type, or symbol table.
+    nshortest: Maximum number of rewrites (0 keeps all the rewrites within the threshold)
+    threshold: Threshold for weights (the beam around the best path, 0 is for all paths)
+    max_states: Optional maximum number of states of the rewrite lattice
+    time_limit: Optional time limit in seconds
+    best_only: Return the best rewrite only
+    Returns:
+    A list of (output string, cost) pairs, sorted by cost.
+    """
+    start = time.monotonic()
+    lattice = rewrite.rewrite_lattice(string, rule, input_token_type)
+    best_only = (
+        best_only
+        or (max_states is not None and lattice.num_states() > max_states)
+        or (time_limit is not None and time.monotonic() - start > time_limit)
+    )
+    if not best_only:
+        dfa = threshold_lattice_to_dfa(lattice, threshold, 4, max_states=max_states)
+        # a DFA cut off at max_states may have lost paths, the best one included
+        if max_states is None or dfa.num_states() < max_states:
+            if nshortest > 0:
+                dfa = pynini.shortestpath(dfa, nshortest=nshortest, unique=True)
+            return _scored_paths(dfa, output_token_type)
+    return _scored_paths(pynini.shortestpath(lattice), output_token_type)
+
+
+def _scored_paths(
+    lattice: pynini.Fst, output_token_type: Optional[pynini.TokenType] = None
+) -> list[tuple[str, float]]:
+    paths = lattice.paths(output_token_type=output_token_type)
+    scored = [(output, float(weight)) for _, output, weight in paths.items()]
+    return sorted(scored, key=lambda rewrite_cost: (rewrite_cost[1], rewrite_cost[0]))
+
+
+def bounded_word_rewrites(
+    word: str,
+    create_word_fst: typing.Callable[[str], Optional[pynini.Fst]],
+    rewrite: typing.Callable[..., list[tuple[str, float]]],
+    max_word_length: int,
+) -> list[tuple[str, float]]:
+    """Returns the rewrites of one word with their costs, best first.
+    A word longer than max_word_length is split into pieces of that length
+    before anything is composed, and the best rewrites of the pieces are joined,
+    so the lattice of a long word never has to be built.
+    Returns an empty list if the word can't be rewritten.
+    """
+    if len(word) <= max_word_length:
+        fst = create_word_fst(word)
+        return rewrite(fst) if fst else []
+    hypotheses = []
+    for i in range(0, len(word), max_word_length):
+        fst = create_word_fst(word[i:i + max_word_length])
+        piece_hypotheses = rewrite(fst, best_only=True) if fst else []
+        if piece_hypotheses:
+            hypotheses.append(piece_hypotheses)
+    if not hypotheses:
+        return []
+    return combine_scored_rewrites(hypotheses)
+
+
+def combine_scored_rewrites(
+    word_hypotheses: list[list[tuple[str, float]]],
+    max_combinations: Optional[int] = None,
+) -> list[tuple[str, float]]:
+    """Joins the rewrites of several words; the cost of a combination is the sum of costs.
+    If there are more than max_combinations combinations, the worst rewrites
+    of the words with the most rewrites are dropped first.
+    Returns a list of (output string, cost) pairs, sorted by cost.
+    """
+    if max_combinations is not None:
+        word_hypotheses = [list(hypotheses) for hypotheses in word_hypotheses]
+        while math.prod(map(len, word_hypotheses)) > max_combinations:
+            # the rewrites are sorted by cost, so the last one is the worst
+            max(word_hypotheses, key=len).pop()
+    combined = {}
+    for combination in itertools.product(*word_hypotheses):
+        output = " ".join(x for x, _ in combination)
+        cost = sum(c for _, c in combination)
+        if output not in combined or cost < combined[output]:
+            combined[output] = cost
+    return sorted(combined.items(), key=lambda rewrite_cost: (rewrite_cost[1], rewrite_cost[0]))
+
+
 class PhonetisaurusRewriter:
     """
     Helper function for rewriting
@@ -93,13 +215,21 @@ class PhonetisaurusRewriter:
     phone_symbol_table: pynini.SymbolTable
         Phone symbol table
     num_pronunciations: int
-        Number of pronunciations, default to 0.  If this is 0, thresholding is used
+        Maximum number of pronunciations, default to 0.  If this is 0, all the pronunciations within the threshold are kept
     threshold: float
-        Threshold to use for pruning rewrite lattice, defaults to 1.5, only used if num_pronunciations is 0
+        Threshold to use for pruning rewrite lattice (the beam around the best path), defaults to 1.5
     grapheme_order: int
         Maximum number of graphemes to consider single segment
     sequence_separator: str
         Separator to use between grapheme symbols
+    max_word_length: int
+        Words longer than this are decoded in pieces of this length, see :func:`bounded_word_rewrites`
+    max_states: int
+        Maximum number of states of a word's rewrite lattice, see :func:`scored_rewrites`
+    time_limit: float
+        Time limit in seconds of a word's rewrite lattice, see :func:`scored_rewrites`
+    max_combinations: int
+        Maximum number of pronunciations of a multi-word input
     """
 
     def __init__(
@@ -113,6 +243,10 @@ class PhonetisaurusRewriter:
         sequence_separator: str = "|",
         graphemes: set[str] = None,
         strict: bool = False,
+        max_word_length: int = MAX_WORD_LENGTH,
+        max_states: int = MAX_LATTICE_STATES,
+        time_limit: float = WORD_TIME_LIMIT,
+        max_combinations: int = MAX_COMBINATIONS,
     ):
         self.fst = fst
         self.sequence_separator = sequence_separator
@@ -121,72 +255,158 @@ class PhonetisaurusRewriter:
         self.grapheme_order = grapheme_order
         self.graphemes = graphemes
         self.strict = strict
-        if num_pronunciations > 0:
-            self.rewrite = functools.partial(
-                rewrite.top_rewrites,
-                nshortest=num_pronunciations,
-                rule=fst,
-                input_token_type=None,
-                output_token_type=self.phone_symbol_table,
-            )
-        else:
-            self.rewrite = functools.partial(
-                optimal_rewrites,
-                threshold=threshold,
-                rule=fst,
-                input_token_type=None,
-                output_token_type=self.phone_symbol_table,
-            )
+        # both the n-best limit and the beam apply: the lattice is thresholded first,
+        # then the num_pronunciations best paths are kept
+        self.rewrite = functools.partial(
+            scored_rewrites,
+            rule=fst,
+            input_token_type=None,
+            output_token_type=self.phone_symbol_table,
+            nshortest=num_pronunciations,
+            threshold=threshold,
+            max_states=max_states,
+            time_limit=time_limit,
+        )
+        self.max_word_length = max_word_length
+        self.max_combinations = max_combinations
+        # grapheme n-gram -> label, read once instead of a table lookup per n-gram
+        self.ngram2label = {symbol: label for label, symbol in grapheme_symbol_table}
+        # the acceptors aren't modified by composition, so they can be shared
+        self.create_word_fst = functools.lru_cache(maxsize=WORD_FST_CACHE_SIZE)(
+            self._create_word_fst
+        )
+
+    def _create_word_fst(self, word: str) -> typing.Optional[pynini.Fst]:
+        """Builds the segmentation lattice of a word: an arc for every grapheme n-gram
+        from the symbol table, compiled from its text form in one native call.
+        Returns None if the word can't be segmented from its first grapheme.
 
-    def create_word_fst(self, word: str) -> typing.Optional[pynini.Fst]:
+        Every word is compiled on its own: a union of many words compiled at once
+        would have to be split into the acceptors of the words again (a copy of the union
+        per word), which costs more than the compilations it saves. Repeated words
+        are served from the cache, see ``create_word_fst``"""
         if self.graphemes is not None:
-            if self.strict and any(not self.grapheme_symbol_table.member(x) for x in word):
+            if self.strict and any(x not in self.ngram2label for x in word):
                 return None
             word = [x for x in word if x in self.graphemes]
         if not word:
             return None
-        fst = pynini.Fst()
-        one = pywrapfst.Weight.one(fst.weight_type())
-        max_state = 0
+        lines = []
         for i in range(len(word)):
-            start_state = fst.add_state()
-            for j in range(1, self.grapheme_order + 1):
-                if i + j <= len(word):
-                    substring = self.sequence_separator.join(word[i : i + j])
-                    ilabel = self.grapheme_symbol_table.find(substring)
-                    if ilabel != pywrapfst.NO_LABEL:
-                        fst.add_arc(start_state, pywrapfst.Arc(ilabel, ilabel, one, i + j))
-                    if i + j >= max_state:
-                        max_state = i + j
-        for _ in range(fst.num_states(), max_state + 1):
-            fst.add_state()
-        fst.set_start(0)
-        fst.set_final(len(word), one)
+            for j in range(1, min(self.grapheme_order, len(word) - i) + 1):
+                substring = self.sequence_separator.join(word[i : i + j])
+                ilabel = self.ngram2label.get(substring)
+                if ilabel is not None:
+                    lines.append(f"{i} {i + j} {ilabel} {ilabel}")
+        # the start state is the source of the first arc
+        if not lines or not lines[0].startswith("0 "):
+            return None
+        lines.append(str(len(word)))
+        compiler = pywrapfst.Compiler(keep_state_numbering=True)
+        compiler.write("\n".join(lines) + "\n")
+        fst = pynini.Fst.from_pywrapfst(compiler.compile())
         fst.set_input_symbols(self.grapheme_symbol_table)
         fst.set_output_symbols(self.grapheme_symbol_table)
         return fst
 
     def __call__(self, graphemes: str) -> list[str]:  # pragma: no cover
         """Call the rewrite function"""
+        return [x for x, _ in self.scored(graphemes)]
+
+    def rewrite_word(self, word: str) -> list[tuple[str, float]]:
+        """Rewrites of one word with their costs, see :func:`bounded_word_rewrites`"""
+        return bounded_word_rewrites(
+            word, self.create_word_fst, self.rewrite, self.max_word_length)
+
+    def scored(self, graphemes: str) -> list[tuple[str, float]]:
+        """Call the rewrite function, keeping the cost of each pronunciation (best first)"""
         if " " in graphemes:
-            words = graphemes.split()
-            hypotheses = []
-            for w in words:
-                w_fst = self.create_word_fst(w)
-                if not w_fst:
-                    continue
-                hypotheses.append(self.rewrite(w_fst))
-            hypotheses = sorted(set(" ".join(x) for x in itertools.product(*hypotheses)))
+            hypotheses = [
+                word_hypotheses
+                for word_hypotheses in map(self.rewrite_word, graphemes.split())
+                if word_hypotheses
+            ]
+            hypotheses = combine_scored_rewrites(hypotheses, self.max_combinations)
         else:
-            fst = self.create_word_fst(graphemes)
-            if not fst:
-                return []
-            hypotheses = self.rewrite(fst)
-        hypotheses = [x.replace(self.sequence_separator, " ") for x in hypotheses if x]
+            hypotheses = self.rewrite_word(graphemes)
+        hypotheses = [
+            (x.replace(self.sequence_separator, " "), cost) for x, cost in hypotheses if x]
         return hypotheses
 
 
-class PyniniGenerator(G2PTopLevelMixin):
+class RewriterMixin:
+    """
+    Mixin class for creating rewriters, and a pool of them shared by threads
+
+    The class using it sets ``fst``, ``input_token_type``, ``output_token_type``,
+    ``num_pronunciations``, ``g2p_threshold`` and ``g2p_meta`` (the model's metadata)
+    before calling :meth:`setup_rewriters`
+    """
+
+    def setup_rewriters(self, pool_size: int = REWRITER_POOL_SIZE) -> None:
+        """Creates the rewriter of the calling thread and an empty pool for the others"""
+        self.rewriter = self.create_rewriter()
+        self.rewriter_pool_size = pool_size
+        self._rewriter_pool = queue.LifoQueue()
+        self._num_pooled_rewriters = 0
+        self._rewriter_pool_lock = threading.Lock()
+
+    def create_rewriter(self) -> Union[PhonetisaurusRewriter, Rewriter]:
+        """Creates a rewriter over the FST and the symbol tables"""
+        if self.g2p_meta["architecture"] == "phonetisaurus":
+            return PhonetisaurusRewriter(
+                self.fst,
+                self.input_token_type,
+                self.output_token_type,
+                num_pronunciations=self.num_pronunciations,
+                threshold=self.g2p_threshold,
+                grapheme_order=self.g2p_meta["grapheme_order"],
+                graphemes=self.g2p_meta["graphemes"],
+            )
+        return Rewriter(
+            self.fst,
+            self.input_token_type,
+            self.output_token_type,
+            num_pronunciations=self.num_pronunciations,
+            threshold=self.g2p_threshold,
+            graphemes=self.g2p_meta["graphemes"],
+        )
+
+    @contextmanager
+    def pooled_rewriter(self) -> typing.Iterator[Union[PhonetisaurusRewriter, Rewriter]]:
+        """
+        Checks out a rewriter for concurrent G2P in one process (e.g. a threaded web server)
+
+        A rewriter, with its word acceptor cache, is used by one thread at a time,
+        so no mutable state is shared between threads. The FST and the symbol tables
+        are shared and only read: the FST is arc-sorted once at setup, and
+        composition and determinization build new FSTs instead of modifying their inputs.
+        At most ``pool_size`` rewriters are created, on demand, however many threads
+        the server runs; when all of them are checked out, the caller waits for one
+        """
+        try:
+            rewriter = self._rewriter_pool.get_nowait()
+        except queue.Empty:
+            with self._rewriter_pool_lock:
+                can_create = self._num_pooled_rewriters < self.rewriter_pool_size
+                if can_create:
+                    self._num_pooled_rewriters += 1
+            if not can_create:
+                rewriter = self._rewriter_pool.get()
+            else:
+                try:
+                    rewriter = self.create_rewriter()
+                except BaseException:
+                    with self._rewriter_pool_lock:
+                        self._num_pooled_rewriters -= 1
+                    raise
+        try:
+            yield rewriter
+        finally:
+            self._rewriter_pool.put(rewriter)
+
+
+class PyniniGenerator(RewriterMixin, G2PTopLevelMixin):
     """
     Class for generating pronunciations from a Pynini G2P model
 
@@ -249,6 +469,9 @@ class PyniniGenerator(G2PTopLevelMixin):
 
     def setup(self):
         self.fst = pynini.Fst.read(self.g2p_model.fst_path)
+        # the rule is the right side of the composition: its input arcs are sorted
+        # once here, so composing never has to sort (i.e. modify) the shared FST
+        self.fst.arcsort(sort_type="ilabel")
         if self.g2p_model.meta["architecture"] == "phonetisaurus":
             self.output_token_type = pywrapfst.SymbolTable.read_text(self.g2p_model.sym_path)
             self.input_token_type = pywrapfst.SymbolTable.read_text(
@@ -256,27 +479,15 @@ class PyniniGenerator(G2PTopLevelMixin):
             )
             self.fst.set_input_symbols(self.input_token_type)
             self.fst.set_output_symbols(self.output_token_type)
-            self.rewriter = PhonetisaurusRewriter(
-                self.fst,
-                self.input_token_type,
-                self.output_token_type,
-                num_pronunciations=self.num_pronunciations,
-                threshold=self.g2p_threshold,
-                grapheme_order=self.g2p_model.meta["grapheme_order"],
-                graphemes=self.g2p_model.meta["graphemes"],
-            )
         else:
             if self.g2p_model.sym_path is not None and os.path.exists(self.g2p_model.sym_path):
                 self.output_token_type = pywrapfst.SymbolTable.read_text(self.g2p_model.sym_path)
+        self.setup_rewriters()
 
-            self.rewriter = Rewriter(
-                self.fst,
-                self.input_token_type,
-                self.output_token_type,
-                num_pronunciations=self.num_pronunciations,
-                threshold=self.g2p_threshold,
-                graphemes=self.g2p_model.meta["graphemes"],
-            )
+    @property
+    def g2p_meta(self) -> dict:
+        """Metadata of the G2P model"""
+        return self.g2p_model.meta
 
     def generate_pronunciations(self) -> dict[str, list[str]]:
         """
@@ -769,7 +980,8 @@ class TopLevelMfaWorker(MfaWorker, TemporaryDirectoryMixin, metaclass=abc.ABCMet
     @property
     def output_directory(self) -> Path:
         """Root temporary directory to store all of this worker's files"""
-        return TEMPORARY_DIRECTORY.joinpath(self.identifier)
+        # resolved (and created) on first use, not at import
+        return get_temporary_directory().joinpath(self.identifier)
 
     @property
     def log_file(self) -> Path:
@@ -1008,8 +1220,134 @@ class PyniniWordListGenerator(PyniniValidator):
         self.g2p_model.validate(self.words_to_g2p)
         self.initialized = True
 
+class PyniniServingGenerator(RewriterMixin):
+    """
+    Pronunciation generator for serving
+
+    Reads the FST, the symbol tables and the metadata straight from the model archive
+    into memory: unlike :class:`PyniniWordListGenerator`, it doesn't unpack the archive,
+    create MFA's working directories, read or write configuration files
+    or validate a word list, so it starts fast and works on a read-only filesystem
+
+    Parameters
+    ----------
+    g2p_model_path: :class:`~pathlib.Path`
+        Path to the G2P model archive (or to its unpacked directory)
+    num_pronunciations: int
+        Number of pronunciations to generate, 0 is no limit
+    g2p_threshold: float
+        Beam around the best pronunciation
+    """
+
+    def __init__(
+        self,
+        g2p_model_path: Union[str, Path],
+        num_pronunciations: int = 0,
+        g2p_threshold: float = 1.5,
+    ):
+        self.g2p_model_path = Path(g2p_model_path)
+        self.num_pronunciations = num_pronunciations
+        self.g2p_threshold = g2p_threshold
+        self.output_token_type = "utf8"
+        self.input_token_type = "utf8"
+        self.rewriter = None
+        self.g2p_meta = None
+
+    def setup(self) -> None:
+        """Loads the model"""
+        files = self.read_model_files()
+        self.g2p_meta = parse_g2p_meta(files)
+        self.fst = pynini.Fst.from_pywrapfst(pywrapfst.Fst.read_from_string(files["model.fst"]))
+        self.fst.arcsort(sort_type="ilabel")
+        phone_table = files.get("phones.txt", files.get("phones.sym"))
+        grapheme_table = files.get("graphemes.txt", files.get("graphemes.sym"))
+        if self.g2p_meta["architecture"] == "phonetisaurus":
+            self.output_token_type = symbol_table_from_text(phone_table, "phones")
+            self.input_token_type = symbol_table_from_text(grapheme_table, "graphemes")
+            self.fst.set_input_symbols(self.input_token_type)
+            self.fst.set_output_symbols(self.output_token_type)
+        elif phone_table is not None:
+            self.output_token_type = symbol_table_from_text(phone_table, "phones")
+        self.setup_rewriters()
+
+    def read_model_files(self) -> dict[str, bytes]:
+        """
+        Reads the files of the model by their names; in old archives
+        they are in a subdirectory
+        """
+        if self.g2p_model_path.is_dir():
+            return {
+                path.name: path.read_bytes()
+                for path in self.g2p_model_path.rglob("*")
+                if path.is_file()
+            }
+        with zipfile.ZipFile(self.g2p_model_path) as archive:
+            return {
+                os.path.basename(name): archive.read(name)
+                for name in archive.namelist()
+                if not name.endswith("/")
+            }
+
+
+def parse_g2p_meta(files: dict[str, bytes]) -> dict:
+    """
+    Parses the metadata of a G2P model from its files, the same way as :attr:`G2PModel.meta`
+
+    Parameters
+    ----------
+    files: dict[str, bytes]
+        Contents of the model's files by their names
+
+    Returns
+    -------
+    dict
+        Metadata
+    """
+    if "meta.json" in files:
+        meta = json.loads(files["meta.json"])
+    elif "meta.yaml" in files:
+        meta = yaml.safe_load(files["meta.yaml"])
+    else:
+        meta = {"version": "0.9.0", "architecture": "phonetisaurus"}
+    meta["phones"] = set(meta.get("phones", []))
+    meta["graphemes"] = set(meta.get("graphemes", []))
+    meta["evaluation"] = meta.get("evaluation", [])
+    meta["training"] = meta.get("training", [])
+    return meta
+
+
+def symbol_table_from_text(text: bytes, name: str) -> pywrapfst.SymbolTable:
+    """
+    Builds a symbol table from the contents of a text symbol table file
+    (a symbol and its label per line), like :meth:`pywrapfst.SymbolTable.read_text`
+    without a file
+
+    Parameters
+    ----------
+    text: bytes
+        Contents of the file
+    name: str
+        Name of the table
+
+    Returns
+    -------
+    :class:`pywrapfst.SymbolTable`
+        Symbol table
+    """
+    table = pywrapfst.SymbolTable(name)
+    for line in text.decode("utf8").splitlines():
+        if not line.strip():
+            continue
+        symbol, label = line.rsplit(maxsplit=1)
+        table.add_symbol(symbol, int(label))
+    return table
+
+
 def threshold_lattice_to_dfa(
-    lattice: pynini.Fst, threshold: float = 1.0, state_multiplier: int = 2
+    lattice: pynini.Fst,
+    threshold: float = 1.0,
+    state_multiplier: int = 2,
+    max_states: Optional[int] = None,
 ) -> pynini.Fst:
     """Constructs a (possibly pruned) weighted DFA of output strings.
     Given an epsilon-free lattice of output strings (such as produced by
@@ -1030,6 +1368,8 @@ def threshold_lattice_to_dfa(
         prunes the lattice to include paths with costs less than the optimal path's score times the threshold
     state_multiplier: int
         Max ratio for the number of states in the DFA lattice to the NFA lattice; if exceeded, a warning is logged.
+    max_states: int, optional
+        Maximum number of states of the DFA lattice, whatever the size of the NFA lattice
 
     Returns
     -------
@@ -1038,7 +1378,11 @@ def threshold_lattice_to_dfa(
     """
     weight_type = lattice.weight_type()
     weight_threshold = pynini.Weight(weight_type, threshold)
+    # pruning the NFA first keeps determinization from expanding paths it'd drop anyway
+    lattice = pynini.prune(lattice, weight=weight_threshold)
     state_threshold = 256 + state_multiplier * lattice.num_states()
+    if max_states is not None:
+        state_threshold = min(state_threshold, max_states)
     lattice = pynini.determinize(lattice, nstate=state_threshold, weight=weight_threshold)
     return lattice
 
@@ -1056,9 +1400,17 @@ class Rewriter:
     output_token_type: pynini.SymbolTable
         Phone symbol table
     num_pronunciations: int
-        Number of pronunciations, default to 0.  If this is 0, thresholding is used
+        Maximum number of pronunciations, default to 0.  If this is 0, all the pronunciations within the threshold are kept
     threshold: float
-        Threshold to use for pruning rewrite lattice, defaults to 1.5, only used if num_pronunciations is 0
+        Threshold to use for pruning rewrite lattice (the beam around the best path), defaults to 1.5
+    max_word_length: int
+        Words longer than this are decoded in pieces of this length, see :func:`bounded_word_rewrites`
+    max_states: int
+        Maximum number of states of a word's rewrite lattice, see :func:`scored_rewrites`
+    time_limit: float
+        Time limit in seconds of a word's rewrite lattice, see :func:`scored_rewrites`
+    max_combinations: int
+        Maximum number of pronunciations of a multi-word input
     """
 
     def __init__(
@@ -1070,27 +1422,29 @@ class Rewriter:
         threshold: float = 1,
         graphemes: set[str] = None,
         strict: bool = False,
+        max_word_length: int = MAX_WORD_LENGTH,
+        max_states: int = MAX_LATTICE_STATES,
+        time_limit: float = WORD_TIME_LIMIT,
+        max_combinations: int = MAX_COMBINATIONS,
     ):
         self.graphemes = graphemes
         self.input_token_type = input_token_type
         self.phone_symbol_table = phone_symbol_table
         self.strict = strict
-        if num_pronunciations > 0:
-            self.rewrite = functools.partial(
-                rewrite.top_rewrites,
-                nshortest=num_pronunciations,
-                rule=fst,
-                input_token_type=None,
-                output_token_type=self.phone_symbol_table,
-            )
-        else:
-            self.rewrite = functools.partial(
-                optimal_rewrites,
-                threshold=threshold,
-                rule=fst,
-                input_token_type=None,
-                output_token_type=self.phone_symbol_table,
-            )
+        # both the n-best limit and the beam apply: the lattice is thresholded first,
+        # then the num_pronunciations best paths are kept
+        self.rewrite = functools.partial(
+            scored_rewrites,
+            rule=fst,
+            input_token_type=None,
+            output_token_type=self.phone_symbol_table,
+            nshortest=num_pronunciations,
+            threshold=threshold,
+            max_states=max_states,
+            time_limit=time_limit,
+        )
+        self.max_word_length = max_word_length
+        self.max_combinations = max_combinations
 
     def create_word_fst(self, word: str) -> pynini.Fst:
         if self.graphemes is not None:
@@ -1102,21 +1456,25 @@ class Rewriter:
 
     def __call__(self, graphemes: str) -> list[str]:  # pragma: no cover
         """Call the rewrite function"""
+        return [x for x, _ in self.scored(graphemes)]
+
+    def rewrite_word(self, word: str) -> list[tuple[str, float]]:
+        """Rewrites of one word with their costs, see :func:`bounded_word_rewrites`"""
+        return bounded_word_rewrites(
+            word, self.create_word_fst, self.rewrite, self.max_word_length)
+
+    def scored(self, graphemes: str) -> list[tuple[str, float]]:
+        """Call the rewrite function, keeping the cost of each pronunciation (best first)"""
         if " " in graphemes:
-            words = graphemes.split()
-            hypotheses = []
-            for w in words:
-                w_fst = self.create_word_fst(w)
-                if not w_fst:
-                    continue
-                hypotheses.append(self.rewrite(w_fst))
-            hypotheses = sorted(set(" ".join(x) for x in itertools.product(*hypotheses)))
+            hypotheses = [
+                word_hypotheses
+                for word_hypotheses in map(self.rewrite_word, graphemes.split())
+                if word_hypotheses
+            ]
+            hypotheses = combine_scored_rewrites(hypotheses, self.max_combinations)
         else:
-            fst = self.create_word_fst(graphemes)
-            if not fst:
-                return []
-            hypotheses = self.rewrite(fst)
-        return [x for x in hypotheses if x]
+            hypotheses = self.rewrite_word(graphemes)
+        return [(x, cost) for x, cost in hypotheses if x]
 
 def clean_up_word(word: str, graphemes: set[str]) -> tuple[str, set[str]]:
     """
@@ -12,6 +12,9 @@ class Grapheme(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     grapheme = db.Column(db.String, nullable=False, unique=True)
     phoneme = db.Column(db.String, nullable=False)
+    # how many times the transcription was looked up by the text-to-audio page;
+    # the audio of the most used ones is synthesized in advance
+    lookup_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     __table_args__ = (
         db.Index('grapheme_table_grapheme_index', grapheme),
@@ -39,7 +42,56 @@ class GraphemeLog(db.Model):
 
     __table_args__ = (
         db.Index('grapheme_log_grapheme_name_index', grapheme_name),
+        # the history of a grapheme is filtered by id and paginated by date
+        db.Index(
+            'grapheme_log_grapheme_id_date_modified_index',
+            grapheme_id, date_modified),
     )
 
     def __repr__(self):
-        return f'GraphemeLog: id=[{self.id}], grapheme={self.grapheme_name}'
\ No newline at end of file
+        return f'GraphemeLog: id=[{self.id}], grapheme={self.grapheme_name}'
+
+
+class PronunciationVariant(db.Model):
+    # how often a transcription of a word occurs in an ingested corpus
+    __tablename__ = 'pronunciation_variants'
+    id = db.Column(db.Integer, primary_key=True)
+    word = db.Column(db.String, nullable=False)
+    variant = db.Column(db.String, nullable=False)
+    # the corpus the counts come from (a content hash of an upload or a path),
+    # so ingesting it again replaces its counts instead of adding them twice
+    source = db.Column(db.String, nullable=False, default='')
+    count = db.Column(db.Integer, nullable=False, default=0)
+    # in seconds, summed over all occurrences
+    total_duration = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index(
+            'pronunciation_variant_word_variant_index',
+            word, variant, source, unique=True),
+    )
+
+    def __repr__(self):
+        return f'PronunciationVariant: <{self.word}>, variant=[{self.variant}], count={self.count}'
+
+
+class Draft(db.Model):
+    # server-side state of the text-to-audio page between its requests,
+    # the page only keeps the token
+    __tablename__ = 'drafts'
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String, nullable=False, unique=True)
+    # JSON: the text, the candidates of every word and the picked ones
+    payload = db.Column(db.Text, nullable=False)
+    date_modified = db.Column(
+        DateTime, nullable=False, default=datetime.utcnow,
+        onupdate=datetime.utcnow
+    )
+
+    __table_args__ = (
+        # expired drafts are deleted by date
+        db.Index('draft_date_modified_index', date_modified),
+    )
+
+    def __repr__(self):
+        return f'Draft: id=[{self.id}], date_modified={self.date_modified}'
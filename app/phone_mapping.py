@@ -0,0 +1,65 @@
+import unicodedata
+
+
+# characters matcha has no symbol for, but which can be spelled
+# with matcha's symbols (espeak writes affricates as two characters)
+FALLBACK_SYMBOLS = {
+    'ʦ': 'ts',
+    'ʣ': 'dz',
+    'ʨ': 'tɕ',
+    'ʥ': 'dʑ',
+}
+
+
+def build_phone_mapping(
+    phone_table, matcha_symbols: list[str]
+) -> tuple[dict[str, str], set[str]]:
+    '''
+    Maps every phone of the G2P phone table (a pywrapfst.SymbolTable)
+    to a string of matcha's symbols, once at model load.
+    A phone is kept as it is if matcha knows all its characters; otherwise
+    its characters are decomposed and the diacritics matcha doesn't know are dropped,
+    and FALLBACK_SYMBOLS are tried.
+
+    Returns a dict phone-to-matcha string and a set of the phones which can't be mapped.
+    '''
+    known_symbols = set(matcha_symbols)
+    phone2symbols = {}
+    unmappable = set()
+    for _, phone in phone_table:
+        # skip <eps>, <unk> and the like
+        if phone.startswith('<') and phone.endswith('>'):
+            continue
+        symbols = _map_phone(phone, known_symbols)
+        if symbols:
+            phone2symbols[phone] = symbols
+        else:
+            unmappable.add(phone)
+    return phone2symbols, unmappable
+
+
+def map_phones(phonemized: str, phone2symbols: dict[str, str]) -> str:
+    '''
+    Converts G2P output ('h ɛ l oʊ') to matcha's input ('hɛloʊ').
+    The phones which aren't in the mapping are passed as they are.
+    '''
+    return ''.join(phone2symbols.get(phone, phone) for phone in phonemized.split())
+
+
+def _map_phone(phone: str, known_symbols: set[str]) -> str:
+    if phone in FALLBACK_SYMBOLS:
+        return FALLBACK_SYMBOLS[phone]
+    mapped = []
+    for char in phone:
+        if char in known_symbols:
+            mapped.append(char)
+        elif char in FALLBACK_SYMBOLS:
+            mapped.append(FALLBACK_SYMBOLS[char])
+        else:
+            for part in unicodedata.normalize('NFD', char):
+                if part in known_symbols:
+                    mapped.append(part)
+                elif not unicodedata.combining(part):
+                    # a base character matcha doesn't know: the phone can't be mapped
+                    return ''
+    return ''.join(mapped)
@@ -0,0 +1,108 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import fcntl
+import os
+import threading
+
+
+class SingleFlight:
+    '''
+    One computation per key at a time: a call with a key which is already
+    in flight waits for the result of that computation instead of starting another one.
+
+    With a lock folder it works across the processes of one machine too:
+    a computation holds an flock on the lock file of its key, and `cached`
+    is checked once the lock is taken, so a process which waited
+    finds the result another process has stored. The keys must be file names then
+    (e.g. content hashes). A lock file is removed when its computation is done,
+    so the folder doesn't grow with the number of keys.
+    '''
+
+    def __init__(self, lock_folder: str = None, max_workers: int = None):
+        self.lock_folder = lock_folder
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='single-flight')
+
+    def do(self, key, compute, cached=None):
+        '''
+        Runs compute() in this thread, or waits for the call in flight with the key.
+        cached: a function which returns the stored result, or None if there is none.
+        '''
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._in_flight[key] = future
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = self._compute(key, compute, cached)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._forget(key, future)
+
+    def submit(self, key, compute, cached=None) -> Future:
+        '''
+        Like do, but compute() runs in a thread pool; returns a Future of the result.
+        Keys submitted together are computed concurrently.
+        '''
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._compute, key, compute, cached)
+            self._in_flight[key] = future
+        # outside the lock: the callback runs right away if the future is done
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def _compute(self, key, compute, cached):
+        if self.lock_folder is None:
+            return compute()
+        with self._process_lock(key):
+            if cached is not None:
+                result = cached()
+                if result is not None:
+                    return result
+            return compute()
+
+    @contextmanager
+    def _process_lock(self, key: str):
+        os.makedirs(self.lock_folder, exist_ok=True)
+        path = os.path.join(self.lock_folder, f'{key}.lock')
+        while True:
+            f = open(path, 'a')
+            # the lock is released by the kernel if the process dies
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # the previous holder may have removed the file while we waited for it:
+            # then the lock is taken on the file which is there now
+            try:
+                is_current = os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+            except FileNotFoundError:
+                is_current = False
+            if is_current:
+                break
+            f.close()
+        try:
+            yield
+        finally:
+            # removed before the lock is released, so the next holder locks a new file
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            f.close()
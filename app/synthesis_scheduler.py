@@ -0,0 +1,187 @@
+from collections import Counter
+from concurrent.futures import Future, TimeoutError
+import queue
+import threading
+import time
+
+
+class SynthesisScheduler:
+    '''
+    Dynamic micro-batching of synthesis requests across threads.
+
+    Callers from all threads put their phonemized strings into one queue;
+    a worker thread takes the first waiting request, collects more
+    for up to `window` seconds or until there are `max_batch_size` of them,
+    runs them as one padded batch and hands every result back to its caller.
+    With `num_workers` threads several batches are in flight at once
+    (e.g. one per process of the inference server).
+
+    A batch is padded to its longest string, so out of the waiting requests
+    the ones closest in length to the oldest one are batched together;
+    the rest go back to the queue. If a batch fails, its strings are retried
+    one by one, so a bad string only fails its own request.
+    '''
+
+    def __init__(
+        self, synthesise_batch, window: float = 0.01, max_batch_size: int = 16,
+        num_workers: int = 1, timeout: float = None
+    ):
+        '''
+        synthesise_batch: a function list of phonemized strings -> list of outputs
+        timeout: seconds synthesise waits for its outputs (None waits forever)
+        '''
+        self.synthesise_batch = synthesise_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._metrics_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._num_requests = 0
+        self._max_queue_depth = 0
+        self._num_running = 0
+        self._threads = []
+
+    def submit(self, phonemized: str) -> Future:
+        # the threads are started on the first request: a process which never
+        # synthesizes (or is forked before it does) doesn't run them.
+        # A thread which has died is replaced
+        if len(self._threads) < self.num_workers or not all(
+                thread.is_alive() for thread in self._threads):
+            self._start()
+        future = Future()
+        self._queue.put((phonemized, future))
+        with self._metrics_lock:
+            self._num_requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def synthesise(self, phonemized_texts: list[str]) -> list[dict]:
+        '''
+        Blocks until all the strings are synthesized; they can end up in different batches.
+        Returns the outputs in the order of the strings.
+        Raises TimeoutError if they aren't synthesized within the timeout.
+        '''
+        futures = [self.submit(text) for text in phonemized_texts]
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        try:
+            return [
+                future.result(
+                    timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+                for future in futures
+            ]
+        except TimeoutError:
+            # the requests still waiting in the queue are dropped
+            for future in futures:
+                future.cancel()
+            raise
+
+    def is_idle(self) -> bool:
+        # no request is waiting and no batch is being synthesized
+        with self._metrics_lock:
+            return self._queue.empty() and self._num_running == 0
+
+    def metrics(self) -> dict:
+        with self._metrics_lock:
+            num_batches = sum(self._batch_sizes.values())
+            num_batched = sum(size * count for size, count in self._batch_sizes.items())
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'num_requests': self._num_requests,
+                'num_batches': num_batches,
+                'mean_batch_size': num_batched / num_batches if num_batches else 0.0,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+                'window_ms': self.window * 1000,
+                'max_batch_size': self.max_batch_size,
+                'num_workers': self.num_workers,
+            }
+
+    def _start(self):
+        with self._metrics_lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for i in range(len(self._threads), self.num_workers):
+                thread = threading.Thread(
+                    target=self._run, name=f'synthesis-scheduler-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        # up to the window or a full batch, then whatever else is waiting,
+        # up to the number of candidates
+        max_candidates = self.max_batch_size * 4
+        while len(batch) < max_candidates:
+            timeout = deadline - time.monotonic()
+            try:
+                if len(batch) >= self.max_batch_size or timeout <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        if len(batch) <= self.max_batch_size:
+            return batch
+        # the oldest request is always in the batch, so none waits forever
+        oldest, rest = batch[0], batch[1:]
+        rest.sort(key=lambda request: abs(len(request[0]) - len(oldest[0])))
+        for request in rest[self.max_batch_size - 1:]:
+            self._queue.put(request)
+        return [oldest] + rest[:self.max_batch_size - 1]
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            with self._metrics_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._num_running += 1
+            try:
+                self._run_batch(batch)
+            finally:
+                with self._metrics_lock:
+                    self._num_running -= 1
+
+    def _run_batch(self, batch):
+        # the caller may have given up (e.g. a closed connection)
+        batch = [
+            (text, future) for text, future in batch
+            if future.set_running_or_notify_cancel()
+        ]
+        if not batch:
+            return
+        try:
+            try:
+                outputs = self._synthesise_all([text for text, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    raise
+                print("Synthesis error, retrying the batch one by one!", e)
+                self._run_one_by_one(batch)
+                return
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+        except BaseException as e:
+            # no caller is left waiting, even if the thread dies
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+
+    def _run_one_by_one(self, batch):
+        for text, future in batch:
+            try:
+                [output] = self._synthesise_all([text])
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(output)
+
+    def _synthesise_all(self, phonemized_texts: list[str]) -> list:
+        outputs = self.synthesise_batch(phonemized_texts)
+        if len(outputs) != len(phonemized_texts):
+            raise RuntimeError(
+                f'{len(outputs)} outputs for a batch of {len(phonemized_texts)}')
+        return outputs
@@ -1,8 +1,12 @@
 from flask import Blueprint
 
+from app.api_views import (
+    g2p_api_view, lexicon_api_view, synthesis_metrics_api_view,
+    synthesize_api_view
+)
 from app.views import (
-    text_to_audio_view, grapheme_log_view,
-    upload_file_view
+    audio_view, text_to_audio_view, grapheme_log_view,
+    grapheme_log_json_view, preview_audio_view, upload_file_view
 )
 
 interface = Blueprint('interface', __name__)
@@ -11,13 +15,46 @@ interface.add_url_rule(
     '/', view_func=text_to_audio_view,
     methods=['GET', 'POST']
 )
+interface.add_url_rule(
+    '/preview', view_func=preview_audio_view,
+    methods=['GET']
+)
+interface.add_url_rule(
+    '/audio/<name>', view_func=audio_view,
+    methods=['GET']
+)
 interface.add_url_rule(
     '/grapheme-log/<int:grapheme_id>',
     view_func=grapheme_log_view,
     methods=['GET']
 )
+interface.add_url_rule(
+    '/grapheme-log/<int:grapheme_id>/json',
+    view_func=grapheme_log_json_view,
+    methods=['GET']
+)
 
 interface.add_url_rule(
     '/upload-file', view_func=upload_file_view,
     methods=['POST', 'GET']
-)
\ No newline at end of file
+)
+
+# JSON API for other services
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+api.add_url_rule(
+    '/g2p', view_func=g2p_api_view,
+    methods=['POST']
+)
+api.add_url_rule(
+    '/synthesize', view_func=synthesize_api_view,
+    methods=['POST']
+)
+api.add_url_rule(
+    '/synthesize/metrics', view_func=synthesis_metrics_api_view,
+    methods=['GET']
+)
+api.add_url_rule(
+    '/lexicon', view_func=lexicon_api_view,
+    methods=['GET', 'POST']
+)
@@ -1,28 +1,396 @@
-from praatio import textgrid
+import codecs
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import multiprocessing as mp
+import os
+from pathlib import Path
+import re
+import zipfile
+import zlib
 
-from collections import defaultdict
 
+Interval = namedtuple('Interval', ['start', 'end', 'label'])
 
-def get_word2phones_from_textgrid(file_path):
-    tg = textgrid.openTextgrid(file_path, includeEmptyIntervals=False)
+CHUNK_SIZE = 64 * 1024
+# what a broken file of a corpus can raise: it's skipped, the others are still parsed
+# (zlib.error: corrupt deflate data, RuntimeError: an encrypted member, EOFError: a truncated one)
+TEXTGRID_ERRORS = (
+    ValueError, OSError, EOFError, RuntimeError, NotImplementedError,
+    zipfile.BadZipFile, zlib.error,
+)
+# an uploaded archive is refused if it has more TextGrids than this
+MAX_ZIP_MEMBERS = 10000
+CORPUS_BATCH_SIZE = 64
+TIER_NAME_SUFFIXES = {
+    'words': ('words', 'word'),
+    'phones': ('phones', 'phone'),
+}
+# praat text files are a stream of values (strings, numbers, flags);
+# labels like `xmin =` or `intervals [1]:` (only in the long format) are skipped
+TEXTGRID_TOKEN_PATTERN = re.compile(
+    r'"(?P<string>(?:[^"]|"")*)"'
+    r'|<(?P<flag>exists|absent)>'
+    r'|(?P<index>\[[^\]]*\])'
+    r'|(?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)'
+)
 
-    # TODO: ask a user for a tier name?
-    word_tier = tg.getTier('words')
-    phone_tier = tg.getTier('phones')
 
-    word2phones = defaultdict(list)
-    phone_entries = phone_tier.entries
-    start = 0
-    for entry in word_tier:
-        word = entry.label
-        word_end = entry.end
+class VariantStats:
+    '''
+    How often each transcription of a word occurs in a corpus
+    and how long it lasts in total (in seconds).
+    '''
+    __slots__ = ('counts', 'durations')
+
+    def __init__(self):
+        self.counts = Counter()
+        self.durations = defaultdict(float)
+
+    def add(self, variant: str, duration: float, count: int = 1):
+        self.counts[variant] += count
+        self.durations[variant] += duration
+
+    def update(self, other: 'VariantStats'):
+        self.counts.update(other.counts)
+        for variant, duration in other.durations.items():
+            self.durations[variant] += duration
+
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def most_common(self) -> list[str]:
+        return [variant for variant, _ in self.counts.most_common()]
+
+
+def get_word2phones_from_textgrid(file, max_size: int = None):
+    '''
+    Takes a path to a TextGrid or a binary file object (e.g. an upload stream).
+    Returns a dict with words as keys and lists of distinct transcriptions as values,
+    the most frequent transcription first.
+    '''
+    word2stats = count_word2phones_from_textgrid(file, max_size)
+    return {word: stats.most_common() for word, stats in word2stats.items()}
+
+
+def count_word2phones_from_textgrid(
+    file, max_size: int = None
+) -> dict[str, VariantStats]:
+    '''
+    Takes a path to a TextGrid or a binary file object (e.g. an upload stream).
+    The file is parsed in one pass; word and phone tiers are detected by their names,
+    so TextGrids with several speakers are supported.
+
+    Returns a dict with words as keys and stats of their transcriptions as values.
+    '''
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as f:
+            return count_word2phones_from_textgrid(f, max_size)
+
+    tiers = read_textgrid_tiers(file, max_size=max_size)
+    tier_pairs = detect_word_phone_tiers(tiers)
+    if not tier_pairs:
+        raise ValueError('Could not find tiers with words and phones in the TextGrid')
+
+    word2stats = defaultdict(VariantStats)
+    for word_tier, phone_tier in tier_pairs:
+        for word, phones, duration in align_phones_to_words(
+            tiers[word_tier], tiers[phone_tier]
+        ):
+            word2stats[word].add(phones, duration)
+    return word2stats
+
+
+def count_word2phones_from_corpus(
+    source: str, num_jobs: int = None
+) -> tuple[dict[str, VariantStats], list[str]]:
+    '''
+    Takes a path to a directory or to a zip archive with TextGrids.
+    The files are parsed in a process pool, in batches of CORPUS_BATCH_SIZE files,
+    and the stats of transcriptions are merged across files.
+
+    Returns the merged stats and the list of files which couldn't be parsed.
+    '''
+    is_zip = zipfile.is_zipfile(source)
+    if is_zip:
+        with zipfile.ZipFile(source) as archive:
+            file_names = [
+                name for name in archive.namelist() if _is_textgrid_name(name)]
+    else:
+        file_names = [
+            str(path) for path in Path(source).rglob('*')
+            if path.is_file() and _is_textgrid_name(path.name)
+        ]
+    batches = [
+        (source, is_zip, file_names[i:i + CORPUS_BATCH_SIZE])
+        for i in range(0, len(file_names), CORPUS_BATCH_SIZE)
+    ]
+
+    word2stats = {}
+    failed_files = []
+    # fork: the workers don't need to import the app (and load the models) again
+    with ProcessPoolExecutor(
+        max_workers=num_jobs, mp_context=mp.get_context('fork')
+    ) as executor:
+        for batch_word2stats, batch_failed_files in executor.map(
+            _count_textgrid_batch, batches
+        ):
+            merge_word2stats(word2stats, batch_word2stats)
+            failed_files.extend(batch_failed_files)
+    return word2stats, failed_files
+
+
+def count_word2phones_from_zip(
+    file, max_size: int = None, max_total_size: int = None,
+    max_members: int = MAX_ZIP_MEMBERS
+) -> tuple[dict[str, VariantStats], list[str]]:
+    '''
+    Takes a path to a zip archive with TextGrids or a seekable binary file object
+    (e.g. an upload stream). The files are parsed one by one in the calling process,
+    so it's safe in a web request: every file is limited to `max_size` bytes,
+    and an archive with more than `max_members` TextGrids or more than `max_total_size` bytes
+    of them unpacked is refused with a ValueError before anything is unpacked.
+    The sizes are the ones the archive declares; zipfile never unpacks more than that.
+
+    Returns the merged stats and the list of files which couldn't be parsed.
+    '''
+    with zipfile.ZipFile(file) as archive:
+        infos = [info for info in archive.infolist() if _is_textgrid_name(info.filename)]
+        if len(infos) > max_members:
+            raise ValueError(
+                f'The archive has {len(infos)} TextGrids, at most {max_members} are allowed')
+        total_size = sum(info.file_size for info in infos)
+        if max_total_size is not None and total_size > max_total_size:
+            raise ValueError(
+                f'The TextGrids of the archive take {total_size // (1024 * 1024)} Mb unpacked, '
+                f'at most {max_total_size // (1024 * 1024)} Mb are allowed')
+        file_names = [info.filename for info in infos]
+        return _count_textgrid_files(file_names, archive.open, max_size)
+
+
+def merge_word2stats(
+    word2stats: dict[str, VariantStats], other: dict[str, VariantStats]
+):
+    for word, stats in other.items():
+        if word in word2stats:
+            word2stats[word].update(stats)
+        else:
+            word2stats[word] = stats
+    return word2stats
+
+
+def hash_upload(file) -> str:
+    '''
+    A content hash of a seekable binary file object, read chunk by chunk;
+    the file is rewound afterwards.
+    '''
+    digest = hashlib.sha1()
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def sort_by_frequency(word2stats: dict[str, VariantStats]) -> dict[str, list[str]]:
+    '''
+    Turns stats into a review batch: the most frequent words go first,
+    and each word's transcriptions are sorted from the most frequent one.
+    '''
+    return {
+        word: stats.most_common()
+        for word, stats in sorted(
+            word2stats.items(), key=lambda item: item[1].total(), reverse=True)
+    }
+
+
+def _count_textgrid_batch(batch) -> tuple[dict[str, VariantStats], list[str]]:
+    source, is_zip, file_names = batch
+    if not is_zip:
+        return _count_textgrid_files(file_names, lambda name: open(name, 'rb'))
+    with zipfile.ZipFile(source) as archive:
+        return _count_textgrid_files(file_names, archive.open)
+
+
+def _count_textgrid_files(
+    file_names: list[str], open_file, max_size: int = None
+) -> tuple[dict[str, VariantStats], list[str]]:
+    # open_file: a function file name -> binary file object
+    word2stats = {}
+    failed_files = []
+    for file_name in file_names:
+        try:
+            with open_file(file_name) as f:
+                file_word2stats = count_word2phones_from_textgrid(f, max_size)
+        except TEXTGRID_ERRORS:
+            failed_files.append(file_name)
+            continue
+        merge_word2stats(word2stats, file_word2stats)
+    return word2stats, failed_files
+
+
+def _is_textgrid_name(file_name: str) -> bool:
+    return (
+        file_name.lower().endswith('.textgrid')
+        and not os.path.basename(file_name).startswith('.')
+    )
+
+
+def detect_word_phone_tiers(tiers: dict[str, list[Interval]]) -> list[tuple[str, str]]:
+    '''
+    Pairs word tiers with phone tiers by their names: `words` and `phones`,
+    or `<speaker> - words` and `<speaker> - phones` in multi-speaker TextGrids from MFA.
+    If the names say nothing and there are only two tiers,
+    the tier with fewer intervals is the word tier.
+    '''
+    speaker2tiers = defaultdict(dict)
+    for tier_name in tiers:
+        lowered = tier_name.strip().lower()
+        for kind, suffixes in TIER_NAME_SUFFIXES.items():
+            suffix = next((suffix for suffix in suffixes if lowered.endswith(suffix)), None)
+            if suffix is not None:
+                speaker = lowered[:-len(suffix)].rstrip(' -_:')
+                speaker2tiers[speaker][kind] = tier_name
+                break
+
+    tier_pairs = [
+        (speaker_tiers['words'], speaker_tiers['phones'])
+        for speaker_tiers in speaker2tiers.values()
+        if 'words' in speaker_tiers and 'phones' in speaker_tiers
+    ]
+    if not tier_pairs and len(tiers) == 2:
+        word_tier, phone_tier = sorted(tiers, key=lambda name: len(tiers[name]))
+        tier_pairs = [(word_tier, phone_tier)]
+    return tier_pairs
+
+
+def align_phones_to_words(
+    word_intervals: list[Interval], phone_intervals: list[Interval]
+):
+    '''
+    Assigns each phone to the word which contains the phone's midpoint.
+    Both tiers are sorted by time, so it's one linear pass with two pointers.
+    Yields (word, joined phones, word duration) for every word with at least one phone.
+    '''
+    word_intervals = sorted(word_intervals, key=lambda interval: interval.start)
+    phone_intervals = sorted(phone_intervals, key=lambda interval: interval.start)
+    num_phones = len(phone_intervals)
+    curr = 0
+    for word in word_intervals:
+        # skip phones between words (e.g. the ones aligned to silence)
+        while curr < num_phones and _midpoint(phone_intervals[curr]) < word.start:
+            curr += 1
         phones = []
-        curr_phone = phone_entries[start]
-        while curr_phone.end < word_end and start < len(phone_entries):
-            curr_phone = phone_entries[start]
-            phones.append(curr_phone.label)
-            start += 1
-        joined_phones = ''.join(phones)
-        if joined_phones not in word2phones[word]:
-            word2phones[word].append(joined_phones)
-    return word2phones
+        while curr < num_phones and _midpoint(phone_intervals[curr]) < word.end:
+            phones.append(phone_intervals[curr].label)
+            curr += 1
+        if phones:
+            yield word.label, ''.join(phones), word.end - word.start
+
+
+def read_textgrid_tiers(
+    stream, tier_names: tuple[str] = None, max_size: int = None
+) -> dict[str, list[Interval]]:
+    '''
+    Streaming reader for praat TextGrids, both in the long and the short text format.
+    Reads the binary stream chunk by chunk and keeps only the non-empty intervals
+    of the interval tiers from `tier_names` (all interval tiers if None).
+    Raises ValueError if the stream is longer than `max_size` bytes
+    or isn't a text TextGrid.
+    '''
+    tokens = _iter_textgrid_tokens(_iter_textgrid_lines(stream, max_size))
+    try:
+        if (_next_string(tokens), _next_string(tokens)) != ('ooTextFile', 'TextGrid'):
+            raise ValueError('The file is not a TextGrid in a text format')
+        _next_number(tokens)  # xmin
+        _next_number(tokens)  # xmax
+        if not next(tokens):  # <absent>: the TextGrid has no tiers
+            return {}
+        num_tiers = int(_next_number(tokens))
+
+        tiers = {}
+        for _ in range(num_tiers):
+            tier_class = _next_string(tokens)
+            tier_name = _next_string(tokens)
+            _next_number(tokens)  # xmin
+            _next_number(tokens)  # xmax
+            num_entries = int(_next_number(tokens))
+            is_interval_tier = tier_class == 'IntervalTier'
+            keep = is_interval_tier and (tier_names is None or tier_name in tier_names)
+            entries = []
+            for _ in range(num_entries):
+                if is_interval_tier:
+                    start = _next_number(tokens)
+                    end = _next_number(tokens)
+                else:
+                    start = end = _next_number(tokens)
+                label = _next_string(tokens).strip()
+                if keep and label:
+                    entries.append(Interval(start, end, label))
+            if keep:
+                tiers[tier_name] = entries
+    except StopIteration:
+        raise ValueError('The TextGrid is truncated')
+    return tiers
+
+
+def _iter_textgrid_lines(stream, max_size: int = None):
+    # praat writes TextGrids either in utf-8 or in utf-16 with a BOM
+    decoder = None
+    size = 0
+    rest = ''
+    while chunk := stream.read(CHUNK_SIZE):
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise ValueError(
+                f'Please upload a file which is less than {max_size // (1024 * 1024)} Mb')
+        if decoder is None:
+            is_utf16 = chunk[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+            decoder = codecs.getincrementaldecoder(
+                'utf-16' if is_utf16 else 'utf-8-sig')()
+        *lines, rest = (rest + decoder.decode(chunk)).split('\n')
+        yield from lines
+    if decoder is not None:
+        rest += decoder.decode(b'', final=True)
+    if rest:
+        yield rest
+
+
+def _iter_textgrid_tokens(lines):
+    # a string can span several lines; since an escaped quote is doubled,
+    # the text is complete when the number of quotes in it is even
+    pending = []
+    num_quotes = 0
+    for line in lines:
+        pending.append(line)
+        num_quotes += line.count('"')
+        if num_quotes % 2:
+            continue
+        text = '\n'.join(pending)
+        pending = []
+        num_quotes = 0
+        for match in TEXTGRID_TOKEN_PATTERN.finditer(text):
+            kind = match.lastgroup
+            if kind == 'string':
+                yield match.group(kind).replace('""', '"')
+            elif kind == 'flag':
+                yield match.group(kind) == 'exists'
+            elif kind == 'number':
+                yield float(match.group(kind))
+
+
+def _midpoint(interval: Interval) -> float:
+    return (interval.start + interval.end) / 2
+
+
+def _next_string(tokens) -> str:
+    token = next(tokens)
+    if not isinstance(token, str):
+        raise ValueError(f'Malformed TextGrid: expected a string, got {token}')
+    return token
+
+
+def _next_number(tokens) -> float:
+    token = next(tokens)
+    if isinstance(token, (str, bool)):
+        raise ValueError(f'Malformed TextGrid: expected a number, got {token}')
+    return token
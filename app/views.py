@@ -1,58 +1,105 @@
+from datetime import datetime
 import json
 import os
-import tempfile
-import time
 
-from flask import render_template, request, redirect, url_for
+from flask import (
+    abort, current_app, jsonify, render_template, request, redirect, send_file,
+    url_for
+)
 from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import RequestEntityTooLarge
 
 from app.ipa_phonemizer import (
     phonemize, get_grapheme2phonemes_from_model,
-    enrich_model_phonemes_with_db, phonemes_to_string,
-    tokenize, is_word
+    enrich_model_phonemes_with_db, phonemes_to_string_with_spans,
+    split_into_chunks, tokenize_with_spans, WORD
+)
+from app.audio_warmer import AUDIO_WARMER
+from app.matcha_utils import (
+    AUDIO_FORMATS, AUDIO_NAME_PATTERN, MAX_PHONEME_LENGTH, audio_name, encode_audio,
+    is_synthesized, negotiate_audio_format, phonemized_to_sequence, synthesize_matcha_audios,
+    synthesize_phonemes
+)
+from app.utils import (
+    count_word2phones_from_textgrid, count_word2phones_from_zip, hash_upload,
+    sort_by_frequency
 )
-from app.matcha_utils import synthesize_matcha_audios
-from app.utils import get_word2phones_from_textgrid
 
-AUDIO = 'static/audio/utterance.wav'
-MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 Mb
+# audio urls are content hashes: browsers and proxies can keep them forever
+AUDIO_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# candidates of each word whose audio the page fetches before they are played
+PREFETCH_CANDIDATES = 2
+# long texts are synthesized sentence by sentence, see synthesize_matcha_audios
+MAX_TEXT_LENGTH = 1000
+LOGS_PER_PAGE = 20
+MAX_LOGS_PER_PAGE = 100
 
 
 def text_to_audio_view():
     # import here, otherwise circular import
     from app import db
     from app.db_utils import (
-        add_graphemes_and_log, fetch_grapheme2phoneme,
-        fetch_grapheme_ids_by_name
+        add_graphemes_and_log, count_lookups, fetch_draft, fetch_grapheme2phoneme,
+        fetch_grapheme_ids_by_name, fetch_variant_counts, save_draft
     )
 
     if request.method == 'POST':
         form = request.form
         text = form['text']
-        words = tokenize(text)
+        # a cut text would be synthesized without its end and nobody would notice
+        if len(text) > MAX_TEXT_LENGTH:
+            return render_template(
+                'text-to-audio.html', text=text,
+                errors=[
+                    f'The text is {len(text)} characters long, '
+                    f'please shorten it to {MAX_TEXT_LENGTH} characters at most.'
+                ])
+        tokens = tokenize_with_spans(text)
+        words = [token.text for token in tokens]
+        # punctuation and numbers aren't phonemized and have no candidates
+        word_set = {token.text for token in tokens if token.kind == WORD}
+        # the state of the page is kept on the server,
+        # the form only posts the draft token and the words the user changed
+        is_edit = form.get('regenerate') or form.get('confirm')
+        draft = fetch_draft(form.get('draft')) if is_edit else None
+        errors = []
+
+        # start over if the draft has expired: the form doesn't have all the picks,
+        # so nothing can be saved, and the user has to know it
+        if is_edit and draft is None:
+            errors.append(
+                'Your session has expired and nothing was saved. '
+                'The transcriptions were generated again: please check them '
+                'and confirm once more.' if form.get('confirm') else
+                'Your session has expired: the transcriptions were generated again.')
 
-        if form.get('generate'):
+        if form.get('generate') or (is_edit and draft is None):
             word2db_phoneme = fetch_grapheme2phoneme(words)
+            # the most used transcriptions are synthesized in advance, see AUDIO_WARMER
+            count_lookups(list(word2db_phoneme))
             word2grapheme_id = fetch_grapheme_ids_by_name(
                 word2db_phoneme.keys())
             word2model_phonemes = get_grapheme2phonemes_from_model(words)
-            word2phonemes, word2picked_phoneme, phonemized_str = (
-                phonemize(words, word2model_phonemes, word2db_phoneme)
+            word2variant_counts = fetch_variant_counts(words)
+            word2phonemes, word2picked_phoneme, _ = (
+                phonemize(
+                    tokens, word2model_phonemes, word2db_phoneme,
+                    word2variant_counts)
             )
             
-        elif form.get('regenerate') or form.get('confirm'):
+        elif is_edit:
             # TODO: it would be nice to show to a user "saved"
             # TODO: handle situation with the wrong input from the user
-            word2model_phonemes = json.loads(form['jsoned_word2model_phonemes'])
-            word2phonemes = json.loads(form["jsoned_word2phonemes"])
+            word2model_phonemes = draft['word2model_phonemes']
+            word2phonemes = draft['word2phonemes']
             word2phonemes, word2picked_phoneme = pick_phoneme_from_form(
-                word2phonemes, form)
-            phonemized_str = phonemes_to_string(words, word2picked_phoneme)
+                word2phonemes, form, word_set, draft['word2picked_phoneme'])
 
             if form.get('confirm'):
                 try:
-                    add_graphemes_and_log(word2picked_phoneme)
+                    changes = add_graphemes_and_log(word2picked_phoneme)
                     db.session.commit()
+                    AUDIO_WARMER.rewarm(changes)
                 except SQLAlchemyError as e:
                     # TODO: show the error to the user
                     db.session.rollback()
@@ -66,82 +113,190 @@ def text_to_audio_view():
         else:
             raise NotImplementedError
 
-        phoneme2audio = synthesize_matcha_audios(text, phonemized_str, word2phonemes)
-        audio = timestamp_audio(AUDIO)
+        # the spans of the words cut the clips of the picked phonemes out of the sentences;
+        # a sentence is only synthesized again if its phonemized string has changed,
+        # and the other candidates are synthesized when they are played
+        chunks = [
+            phonemes_to_string_with_spans(chunk, word2picked_phoneme)
+            for chunk in split_into_chunks(tokens)
+        ]
+        utterance_name, phoneme2clip_name = synthesize_matcha_audios(chunks)
+        db_phonemes = set(word2db_phoneme.values())
+        # the name is a hash of the content, so the url of changed audio is a new one
+        audio = utterance_name and url_for('interface.audio_view', name=utterance_name)
+
+        draft_token = save_draft(
+            {
+                'text': text,
+                'word2phonemes': word2phonemes,
+                'word2model_phonemes': word2model_phonemes,
+                'word2picked_phoneme': word2picked_phoneme,
+            },
+            token=form.get('draft') if draft else None)
+        db.session.commit()
 
         return render_template(
             'text-to-audio.html', audio=audio,
-            phoneme2audio=phoneme2audio,
+            prefetch_candidates=PREFETCH_CANDIDATES,
             text=text, word2phonemes=word2phonemes,
             word2picked_phoneme=word2picked_phoneme,
-            jsoned_word2phonemes=json.dumps(word2phonemes, ensure_ascii=False),
             word2db_phoneme=word2db_phoneme,
             word2model_phonemes=word2model_phonemes,
-            jsoned_word2model_phonemes = json.dumps(
-                word2model_phonemes, ensure_ascii=False),
+            draft_token=draft_token,
             word2grapheme_id=word2grapheme_id,
-            is_word=is_word
+            word_set=word_set,
+            phoneme2clip_url={
+                phoneme: url_for('interface.audio_view', name=name)
+                for phoneme, name in phoneme2clip_name.items()
+                # a db transcription warmed by AUDIO_WARMER is played from its own audio
+                # (the preview url): unlike a clip, it's the same in every text
+                if not (phoneme in db_phonemes and is_synthesized(audio_name(phoneme)))
+            },
+            errors=errors
         )
 
     return render_template('text-to-audio.html')
 
 
+def preview_audio_view():
+    '''
+    Audio of a candidate phoneme, synthesized on its first play.
+    Redirects to the audio's own url, which can be cached
+    (the audio of a phoneme changes with the hyperparameters).
+    '''
+    phoneme = request.args.get('phoneme', '').strip()
+    if not phoneme or len(phoneme) > MAX_PHONEME_LENGTH:
+        abort(400)
+    try:
+        phonemized_to_sequence(phoneme, unknown_policy='error')
+    except ValueError:
+        abort(400)
+    name = synthesize_phonemes([phoneme])[phoneme]
+    return redirect(url_for('interface.audio_view', name=name))
+
+
+def audio_view(name):
+    '''
+    A synthesized audio, in the format the client prefers.
+    The name is a hash of the content, so it's served with a long-lived Cache-Control
+    and a strong ETag; If-None-Match and Range requests are handled by send_file.
+    '''
+    if not AUDIO_NAME_PATTERN.fullmatch(name):
+        abort(404)
+    # the format is picked by the Accept header, so caches have to key on it
+    audio_format = negotiate_audio_format(request.accept_mimetypes)
+    try:
+        path = encode_audio(name, audio_format)
+    except FileNotFoundError:
+        abort(404)
+    except Exception as e:
+        # the wav is always there: a format which can't be encoded isn't an error for the client
+        print("Error!", e)
+        audio_format = 'wav'
+        path = encode_audio(name, audio_format)
+    response = send_file(
+        os.path.abspath(path), mimetype=AUDIO_FORMATS[audio_format][0],
+        conditional=True, etag=f'{name}.{audio_format}')
+    response.headers['Cache-Control'] = AUDIO_CACHE_CONTROL
+    response.vary.add('Accept')
+    return response
+
+
 def grapheme_log_view(grapheme_id):
     from app.db_utils import fetch_grapheme_logs, fetch_grapheme
-    from app.models import Grapheme
 
-    grapheme_logs = fetch_grapheme_logs(grapheme_id)
     grapheme, phoneme = fetch_grapheme(grapheme_id)
+    before = parse_log_cursor(request.args.get('before'))
+    grapheme_logs, next_key = fetch_grapheme_logs(
+        grapheme_id, limit=LOGS_PER_PAGE, before=before)
 
     return render_template(
         'grapheme-log.html', 
         grapheme=grapheme,
         phoneme=phoneme,
-        grapheme_logs=grapheme_logs)
+        grapheme_id=grapheme_id,
+        grapheme_logs=grapheme_logs,
+        is_first_page=before is None,
+        next_cursor=make_log_cursor(next_key))
+
+
+def grapheme_log_json_view(grapheme_id):
+    from app.db_utils import fetch_grapheme_logs, fetch_grapheme
+
+    grapheme, phoneme = fetch_grapheme(grapheme_id)
+    before = parse_log_cursor(request.args.get('before'))
+    limit = request.args.get('limit', LOGS_PER_PAGE, type=int)
+    limit = min(max(limit, 1), MAX_LOGS_PER_PAGE)
+    grapheme_logs, next_key = fetch_grapheme_logs(
+        grapheme_id, limit=limit, before=before)
+
+    return jsonify({
+        'grapheme': grapheme,
+        'phoneme': phoneme,
+        'logs': [
+            {
+                'from_phoneme': log.from_phoneme,
+                'to_phoneme': log.to_phoneme,
+                'date_modified': log.date_modified.isoformat(),
+            }
+            for log in grapheme_logs
+        ],
+        'next_cursor': make_log_cursor(next_key),
+    })
 
 
 def upload_file_view():
     # imported here due to circular import
     from app import db
-    from app.db_utils import filter_out_existing_words, save_word2phones
+    from app.db_utils import (
+        filter_out_existing_words, save_variant_stats, save_word2phones
+    )
 
     save_flag = False
     errors = []
     new_words2phones = {}
+    word2stats = {}
     file_name = None
     discarded_words = []
     
-    file = request.files.get('file')
+    max_size = current_app.config['MAX_CONTENT_LENGTH']
+    try:
+        file = request.files.get('file')
+    except RequestEntityTooLarge:
+        file = None
+        errors.append(f'Please upload a file which is less than {max_size // (1024 * 1024)} Mb')
     
     if file:
         file_name = file.filename[:50]
-        file_content = file.read()
-        if len(file_content) > MAX_FILE_SIZE:
-            errors.append('Please upload a file which is less than 5 Mb')
-        else: 
-            file.seek(0)
-
-            # Create a temporary file with a secure filename in order for textgrid to read it
-            # (textgrid can't read from a file object, it needs a path in a str format)
-            _, temp_path = tempfile.mkstemp(suffix=os.path.splitext(file.filename)[1])
-            
-            try:
-                with open(temp_path, 'wb') as temp_file:
-                    temp_file.write(file_content)
-                word2phones = get_word2phones_from_textgrid(temp_path)
-                if not word2phones:
-                    errors.append('No words found in the TextGrid. Please upload a new TextGrid.')
-                new_words2phones = filter_out_existing_words(word2phones)
-                if not new_words2phones:
-                    errors.append('All words from the TextGrid are already in the database.')
-
-            except Exception as e:
-                errors.append(f'An error happened during uploading of your file: {e}')
-
-            finally:
-                os.remove(temp_path)
-
-    elif request.form.get('confirm_changes'):
+        try:
+            upload_hash = hash_upload(file.stream)
+            if file.filename.lower().endswith('.zip'):
+                # parsed in this thread: forking a process with the models,
+                # the scheduler and the thread pools running can deadlock
+                word2stats, failed_files = count_word2phones_from_zip(
+                    file.stream, max_size=max_size,
+                    max_total_size=current_app.config['MAX_UNZIPPED_SIZE'])
+                if failed_files:
+                    errors.append(f'Could not parse {len(failed_files)} files from the archive.')
+            else:
+                # the upload is parsed straight from its stream, chunk by chunk
+                word2stats = count_word2phones_from_textgrid(file.stream, max_size=max_size)
+            if not word2stats:
+                errors.append('No words found in the TextGrid. Please upload a new TextGrid.')
+            # the stats of all words are kept: they rank the candidates of the G2P model.
+            # The same file uploaded again replaces its stats
+            save_variant_stats(word2stats, source=f'upload:{upload_hash}')
+            db.session.commit()
+            word2stats = filter_out_existing_words(word2stats)
+            if not word2stats:
+                errors.append('All words from the TextGrid are already in the database.')
+            new_words2phones = sort_by_frequency(word2stats)
+
+        except Exception as e:
+            db.session.rollback()
+            errors.append(f'An error happened during uploading of your file: {e}')
+
+    elif not errors and request.form.get('confirm_changes'):
         form = request.form
 
         file_name  = form['file_name']
@@ -181,25 +336,44 @@ def upload_file_view():
         save_flag=save_flag,
         errors=errors,
         discarded_words=discarded_words,
+        word2stats=word2stats,
     )
 
 
-def timestamp_audio(filename):
-    # timestamp is needed since the audio is stored in the same path,
-    # so the browser caches the audio and doesn't update it (== plays the old audio)
-    timestamp = str(int(time.time()))
-    return f'{filename}?v{timestamp}'
+def make_log_cursor(key):
+    # the cursor of a page is the (date_modified, id) of the last log on it
+    if key is None:
+        return None
+    date_modified, log_id = key
+    return f'{date_modified.isoformat()}_{log_id}'
 
 
-def pick_phoneme_from_form(word2phonemes, form):
-    from app.db_utils import fetch_grapheme2phoneme
+def parse_log_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        date_modified, log_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(date_modified), int(log_id)
+    except ValueError:
+        abort(400)
+
+
+def pick_phoneme_from_form(word2phonemes, form, word_set, word2draft_picked):
+    from app.db_utils import fetch_grapheme2phoneme, fetch_variant_counts
 
     word2picked_phoneme = {}
     for word, all_phonemes in word2phonemes.items() :
-        if not is_word(word):
+        if word not in word_set:
             continue
         # form phonemes: radio input -- either picked or orthographic
         form_phonemes = form.getlist(word)
+        # the words the user didn't change aren't posted: keep the picks from the draft
+        if not form_phonemes:
+            # a word without candidates has no pick
+            picked = word2draft_picked.get(word) or next(iter(all_phonemes), None)
+            if picked:
+                word2picked_phoneme[word] = picked
+            continue
         picked, manual_input = form_phonemes
         # manual for now is orthographic only!
         # there is no any validation here!
@@ -220,17 +394,23 @@ def pick_phoneme_from_form(word2phonemes, form):
                 orthograpic2model_phonemes = get_grapheme2phonemes_from_model(
                     [orthograpic])
                 orthograpic2db_phoneme = fetch_grapheme2phoneme([orthograpic])
+                orthograpic2variant_counts = fetch_variant_counts([orthograpic])
                 orthograpic2phonemes, orthograpic2picked_phoneme = (
                     enrich_model_phonemes_with_db(
                         orthograpic2model_phonemes,
-                        orthograpic2db_phoneme))
+                        orthograpic2db_phoneme,
+                        orthograpic2variant_counts))
                 new_phonemes = [
                     phoneme 
                     for phoneme in orthograpic2phonemes[orthograpic] 
                     if phoneme not in all_phonemes
                 ]
-                picked_phoneme = orthograpic2picked_phoneme[orthograpic]
-                word2picked_phoneme[word] = picked_phoneme
+                # the spelling may have no pronunciation either: keep the previous pick
+                picked_phoneme = (
+                    orthograpic2picked_phoneme.get(orthograpic)
+                    or word2draft_picked.get(word))
+                if picked_phoneme:
+                    word2picked_phoneme[word] = picked_phoneme
                 word2phonemes[word].extend(new_phonemes)
     
     return word2phonemes, word2picked_phoneme
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+# creating the app (on `from app import app`) loads the G2P and matcha models
+for module in ('flask', 'flask_sqlalchemy', 'pynini', 'torch', 'matcha'):
+    pytest.importorskip(module)
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app import app, db  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    db.create_all()
+    yield app.test_client()
+    db.session.remove()
+    db.drop_all()
+
+
+def test_g2p_word_without_candidates(client):
+    # a word (it's alphabetic) in graphemes the model doesn't know
+    response = client.post('/api/v1/g2p', json={'words': ['привет', 'hello']})
+    assert response.status_code == 200
+    words = response.get_json()['words']
+    for result in words.values():
+        if result['candidates']:
+            assert result['candidates'][0] == result['picked']
+        else:
+            assert result['picked'] is None
+
+
+@pytest.mark.parametrize('lexicon', [{'  ': 'həloʊ'}, {'hello': ' '}, {'hello': 1}])
+def test_lexicon_rejects_empty_words_and_transcriptions(client, lexicon):
+    response = client.post('/api/v1/lexicon', json={'lexicon': lexicon})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_synthesize_rejects_too_long_phonemes(client):
+    response = client.post('/api/v1/synthesize', json={'phonemes': ['həloʊ ' * 50]})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+@pytest.mark.parametrize('url', ['/grapheme-log/12345', '/grapheme-log/12345/json'])
+def test_log_of_an_unknown_grapheme_is_not_found(client, url):
+    assert client.get(url).status_code == 404
@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+import pathlib
+
+import pytest
+
+# app.load_models loads the G2P and matcha models
+for module in ('pynini', 'torch', 'matcha'):
+    pytest.importorskip(module)
+
+from app.load_models import G2P_CHECKPOINT  # noqa: E402
+from app.mfa_g2p.generator import PyniniServingGenerator  # noqa: E402
+
+WORDS = ['hello', 'world', 'pronunciation', 'read', 'lead', 'phoneme', 'tomato', 'the'] * 8
+
+
+@pytest.fixture(scope='module')
+def g2p():
+    g2p = PyniniServingGenerator(g2p_model_path=pathlib.Path(G2P_CHECKPOINT))
+    g2p.setup()
+    g2p.setup_rewriters(pool_size=2)
+    return g2p
+
+
+def test_concurrent_rewrites_match_serial(g2p):
+    serial = [g2p.rewriter.scored(word) for word in WORDS]
+
+    def scored(word):
+        with g2p.pooled_rewriter() as rewriter:
+            return rewriter.scored(word)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        concurrent = list(executor.map(scored, WORDS))
+    assert concurrent == serial
+    # the threads share the pool, however many of them there are
+    assert g2p._num_pooled_rewriters <= 2
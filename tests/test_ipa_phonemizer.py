@@ -0,0 +1,45 @@
+from app.ipa_phonemizer import (
+    WORD, enrich_model_phonemes_with_db, phonemes_to_string_with_spans, split_into_chunks,
+    tokenize_with_spans
+)
+
+TEXT = 'Hello, world! It is 42 degrees; hello again.'
+WORD2PHONEME = {
+    'hello': 'həloʊ', 'world': 'wɝld', 'it': 'ɪt', 'is': 'ɪz',
+    'degrees': 'dɪɡɹiz', 'again': 'əɡɛn',
+}
+
+
+def chunk_strings(word2picked_phoneme):
+    tokens = tokenize_with_spans(TEXT)
+    return [
+        phonemes_to_string_with_spans(chunk, word2picked_phoneme)
+        for chunk in split_into_chunks(tokens)
+    ]
+
+
+def test_unchanged_regenerate_gives_the_same_chunks():
+    tokens = tokenize_with_spans(TEXT)
+    # generate: the model maps punctuation and numbers to themselves
+    generated = chunk_strings(
+        {**{token.text: token.text for token in tokens}, **WORD2PHONEME})
+    # regenerate and confirm: only the words are picked from the form
+    regenerated = chunk_strings({
+        token.text: WORD2PHONEME[token.text] for token in tokens if token.kind == WORD})
+    assert regenerated == generated
+    assert [phonemized for phonemized, _ in generated] == [
+        'həloʊ, wɝld!', 'ɪt ɪz 42 dɪɡɹiz;', 'həloʊ əɡɛn.']
+
+
+def test_word_spans_point_at_the_phonemes():
+    for phonemized, word_spans in chunk_strings(WORD2PHONEME):
+        for phoneme, start, end in word_spans:
+            assert phonemized[start:end] == phoneme
+
+
+def test_enrich_skips_the_pick_of_a_word_without_candidates():
+    word2phonemes, word2picked_phoneme = enrich_model_phonemes_with_db(
+        {'привет': [], 'hello': ['həloʊ']}, {})
+    assert word2phonemes['привет'] == []
+    assert 'привет' not in word2picked_phoneme
+    assert word2picked_phoneme['hello'] == 'həloʊ'
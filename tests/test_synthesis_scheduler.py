@@ -0,0 +1,71 @@
+from concurrent.futures import TimeoutError
+import threading
+
+import pytest
+
+from app.synthesis_scheduler import SynthesisScheduler
+
+
+def test_a_bad_string_only_fails_its_own_request():
+    def synthesise_batch(texts):
+        if 'bad' in texts:
+            raise ValueError('bad')
+        return [text.upper() for text in texts]
+
+    scheduler = SynthesisScheduler(synthesise_batch, window=0.05, max_batch_size=4)
+    futures = [scheduler.submit(text) for text in ('a', 'bad', 'c')]
+    assert futures[0].result(timeout=5) == 'A'
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == 'C'
+
+
+def test_synthesise_times_out():
+    release = threading.Event()
+
+    def synthesise_batch(texts):
+        release.wait()
+        return texts
+
+    scheduler = SynthesisScheduler(synthesise_batch, window=0, timeout=0.1)
+    with pytest.raises(TimeoutError):
+        scheduler.synthesise(['a'])
+    release.set()
+
+
+def test_strings_of_similar_length_are_batched_together():
+    started, release = threading.Event(), threading.Event()
+    batches = []
+
+    def synthesise_batch(texts):
+        if not started.is_set():
+            # the worker is busy while the queue fills up
+            started.set()
+            release.wait()
+        batches.append(sorted(texts, key=len))
+        return texts
+
+    scheduler = SynthesisScheduler(synthesise_batch, window=0, max_batch_size=2)
+    first = scheduler.submit('x')
+    started.wait(timeout=5)
+    futures = [scheduler.submit(text) for text in ('a', 'b' * 10, 'c', 'd' * 10)]
+    release.set()
+    assert first.result(timeout=5) == 'x'
+    for future in futures:
+        future.result(timeout=5)
+    assert batches[1:] == [['a', 'c'], ['b' * 10, 'd' * 10]]
+
+
+# the worker thread dies with the SystemExit on purpose
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_a_dead_worker_is_replaced():
+    def synthesise_batch(texts):
+        if texts == ['exit']:
+            raise SystemExit
+        return texts
+
+    scheduler = SynthesisScheduler(synthesise_batch, window=0)
+    with pytest.raises(SystemExit):
+        scheduler.submit('exit').result(timeout=5)
+    scheduler._threads[0].join(timeout=5)
+    assert scheduler.submit('a').result(timeout=5) == 'a'
@@ -0,0 +1,165 @@
+import io
+import zipfile
+
+import pytest
+
+from app import utils
+from app.utils import (
+    Interval, align_phones_to_words, count_word2phones_from_textgrid,
+    count_word2phones_from_zip, detect_word_phone_tiers, read_textgrid_tiers
+)
+
+# (tier name, [(start, end, label)]); empty labels are silences
+TIERS = [
+    ('words', [(0, 0.5, 'hello'), (0.5, 0.6, ''), (0.6, 1.2, 'world')]),
+    ('phones', [
+        (0, 0.1, 'h'), (0.1, 0.2, 'ə'), (0.2, 0.35, 'l'), (0.35, 0.5, 'oʊ'),
+        (0.5, 0.6, 'sil'), (0.6, 0.8, 'w'), (0.8, 1.0, 'ɝ'), (1.0, 1.2, 'ld'),
+    ]),
+]
+WORD2PHONES = {'hello': ['həloʊ'], 'world': ['wɝld']}
+
+
+def quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def long_textgrid(tiers, xmax=1.2):
+    lines = [
+        'File type = "ooTextFile"', 'Object class = "TextGrid"', '',
+        'xmin = 0', f'xmax = {xmax}', 'tiers? <exists>', f'size = {len(tiers)}', 'item []:',
+    ]
+    for i, (name, intervals) in enumerate(tiers, 1):
+        lines += [
+            f'    item [{i}]:', '        class = "IntervalTier"',
+            f'        name = {quote(name)}', '        xmin = 0', f'        xmax = {xmax}',
+            f'        intervals: size = {len(intervals)}',
+        ]
+        for j, (start, end, label) in enumerate(intervals, 1):
+            lines += [
+                f'        intervals [{j}]:', f'            xmin = {start}',
+                f'            xmax = {end}', f'            text = {quote(label)}',
+            ]
+    return '\n'.join(lines) + '\n'
+
+
+def short_textgrid(tiers, xmax=1.2):
+    lines = ['File type = "ooTextFile"', 'Object class = "TextGrid"', '', '0', str(xmax),
+             '<exists>', str(len(tiers))]
+    for name, intervals in tiers:
+        lines += ['"IntervalTier"', quote(name), '0', str(xmax), str(len(intervals))]
+        for start, end, label in intervals:
+            lines += [str(start), str(end), quote(label)]
+    return '\n'.join(lines) + '\n'
+
+
+def word2phones(data, **kwargs):
+    word2stats = count_word2phones_from_textgrid(io.BytesIO(data), **kwargs)
+    return {word: stats.most_common() for word, stats in word2stats.items()}
+
+
+@pytest.mark.parametrize('make_textgrid', [long_textgrid, short_textgrid])
+def test_long_and_short_formats(make_textgrid):
+    assert word2phones(make_textgrid(TIERS).encode()) == WORD2PHONES
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'utf-8-sig', 'utf-16', 'utf-16-be'])
+def test_encodings_and_crlf(monkeypatch, encoding):
+    text = long_textgrid(TIERS).replace('\n', '\r\n')
+    data = text.encode(encoding)
+    if encoding == 'utf-16-be':
+        data = b'\xfe\xff' + data
+    # the characters and the line ends are split between the chunks
+    monkeypatch.setattr(utils, 'CHUNK_SIZE', 7)
+    assert word2phones(data) == WORD2PHONES
+
+
+def test_escaped_quotes_and_multiline_labels():
+    tiers = [
+        ('words', [(0, 0.5, 'say "hi"'), (0.5, 1, 'two\nlines')]),
+        ('phones', [(0, 0.5, 'seɪ'), (0.5, 1, 'tu')]),
+    ]
+    for make_textgrid in (long_textgrid, short_textgrid):
+        intervals = read_textgrid_tiers(io.BytesIO(make_textgrid(tiers, xmax=1).encode()))
+        assert [interval.label for interval in intervals['words']] == ['say "hi"', 'two\nlines']
+
+
+def test_speaker_tiers_are_paired():
+    speaker_tiers = [
+        ('Alice - words', [(0, 0.5, 'hello')]),
+        ('Alice - phones', [(0, 0.25, 'hə'), (0.25, 0.5, 'loʊ')]),
+        ('Bob - words', [(0.5, 1, 'hello')]),
+        ('Bob - phones', [(0.5, 0.75, 'hɛ'), (0.75, 1, 'loʊ')]),
+    ]
+    tiers = read_textgrid_tiers(io.BytesIO(long_textgrid(speaker_tiers, xmax=1).encode()))
+    assert sorted(detect_word_phone_tiers(tiers)) == [
+        ('Alice - words', 'Alice - phones'), ('Bob - words', 'Bob - phones')]
+    word2stats = count_word2phones_from_textgrid(
+        io.BytesIO(short_textgrid(speaker_tiers, xmax=1).encode()))
+    assert dict(word2stats['hello'].counts) == {'həloʊ': 1, 'hɛloʊ': 1}
+
+
+def test_unnamed_tiers_are_told_apart_by_size():
+    tiers = {'a': [Interval(0, 1, 'p'), Interval(1, 2, 'q')], 'b': [Interval(0, 2, 'w')]}
+    assert detect_word_phone_tiers(tiers) == [('b', 'a')]
+
+
+def test_phones_go_to_the_word_with_their_midpoint():
+    words = [Interval(1, 2, 'b'), Interval(0, 1, 'a'), Interval(3, 4, 'c')]
+    phones = [
+        Interval(0, 0.6, 'x'), Interval(0.6, 1.4, 'y'), Interval(1.4, 2, 'z'),
+        Interval(2, 3, 'sil'), Interval(3.9, 4.5, 'v'),
+    ]
+    # the sorted words; the phone between the words is dropped,
+    # and "c" has no phone whose midpoint is in it
+    assert list(align_phones_to_words(words, phones)) == [('a', 'x', 1), ('b', 'yz', 1)]
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'not a textgrid',
+    long_textgrid(TIERS).encode()[:-200],
+])
+def test_broken_textgrids_raise_value_error(data):
+    with pytest.raises(ValueError):
+        count_word2phones_from_textgrid(io.BytesIO(data))
+
+
+def test_max_size():
+    data = long_textgrid(TIERS).encode()
+    with pytest.raises(ValueError):
+        count_word2phones_from_textgrid(io.BytesIO(data), max_size=len(data) - 1)
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def test_zip_skips_broken_members():
+    data = long_textgrid(TIERS).encode()
+    archive = make_zip({'a.TextGrid': data, 'b.TextGrid': data, 'notes.txt': b'x'})
+    # corrupt the deflate stream of the second member
+    raw = bytearray(archive.getvalue())
+    offset = zipfile.ZipFile(io.BytesIO(raw)).getinfo('b.TextGrid').header_offset
+    raw[offset + 60:offset + 90] = b'\xff' * 30
+    word2stats, failed_files = count_word2phones_from_zip(io.BytesIO(raw))
+    assert failed_files == ['b.TextGrid']
+    assert {word: stats.most_common() for word, stats in word2stats.items()} == WORD2PHONES
+
+
+def test_zip_limits():
+    data = long_textgrid(TIERS).encode()
+    members = {f'{i}.TextGrid': data for i in range(3)}
+    with pytest.raises(ValueError):
+        count_word2phones_from_zip(make_zip(members), max_members=2)
+    with pytest.raises(ValueError):
+        count_word2phones_from_zip(make_zip(members), max_total_size=3 * len(data) - 1)
+    word2stats, failed_files = count_word2phones_from_zip(
+        make_zip(members), max_members=3, max_total_size=3 * len(data))
+    assert failed_files == []
+    assert word2stats['hello'].total() == 3